@@ -0,0 +1,15 @@
+import os
+
+##picked up by `gunicorn quartz_project.wsgi` from the project root (see the Procfile and readme).
+##threaded workers: a request waiting on cloudinary or postgres blocks one thread, not the whole
+##worker, so a dyno serves workers * threads requests at once. every thread keeps its own
+##database connection (CONN_MAX_AGE), keep workers * threads + JOB_WORKERS under the postgres limit
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+##recycle workers now and then so a leak in an image library cannot grow forever
+max_requests = 1000
+max_requests_jitter = 100
+accesslog = '-'
@@ -0,0 +1 @@
+default_app_config = 'library_app.apps.LibraryAppConfig'
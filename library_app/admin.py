@@ -1,8 +1,16 @@
 from django.contrib import admin
 from .models import Album
 from .models import Image
+from .models import Job
+from .models import Rendition
+from .models import UploadSession
+from .models import Blob
 
 
 admin.site.register(Album)
 admin.site.register(Image)
+admin.site.register(Job)
+admin.site.register(Rendition)
+admin.site.register(UploadSession)
+admin.site.register(Blob)
 
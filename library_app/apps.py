@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class LibraryAppConfig(AppConfig):
     name = 'library_app'
+
+    def ready(self):
+        ##registers the job handlers and the fragment cache receivers
+        from . import signals, tasks  # noqa
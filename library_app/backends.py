@@ -0,0 +1,68 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+##local media backends selected by MEDIA_STORAGE in settings, so the whole media path (uploads,
+##renditions, exports, deletes) runs and can be benchmarked without cloudinary or the network
+
+
+@deconstructible
+class LocalStorage(FileSystemStorage):
+    ##MEDIA_ROOT on this machine, served by quartz_app.views.serve_media
+
+    def batch_exists(self, names):
+        return {name: os.path.exists(self.path(name)) for name in names}
+
+
+@deconstructible
+class FakeS3Storage(LocalStorage):
+    ##an S3 bucket stand-in on local disk: every request waits FAKE_S3_LATENCY_MS like a round trip
+    ##to the bucket would, and deletes and lookups take up to BATCH keys per request the way
+    ##DeleteObjects and ListObjectsV2 do. names are made unique like AWS_S3_FILE_OVERWRITE = False
+    BATCH = 1000
+
+    def _round_trip(self):
+        latency = settings.FAKE_S3_LATENCY_MS
+        if latency:
+            time.sleep(latency / 1000.0)
+
+    def _open(self, name, mode='rb'):
+        self._round_trip()
+        return super()._open(name, mode)
+
+    def _save(self, name, content):
+        self._round_trip()
+        return super()._save(name, content)
+
+    def delete(self, name):
+        self._round_trip()
+        super().delete(name)
+
+    def exists(self, name):
+        self._round_trip()
+        return super().exists(name)
+
+    def size(self, name):
+        self._round_trip()
+        return super().size(name)
+
+    def listdir(self, path):
+        self._round_trip()
+        return super().listdir(path)
+
+    def batch_delete(self, names):
+        for start in range(0, len(names), self.BATCH):
+            self._round_trip()
+            for name in names[start:start + self.BATCH]:
+                super().delete(name)
+
+    def batch_exists(self, names):
+        found = {}
+        for start in range(0, len(names), self.BATCH):
+            self._round_trip()
+            found.update(super().batch_exists(names[start:start + self.BATCH]))
+        return found
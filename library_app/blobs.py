@@ -0,0 +1,95 @@
+import hashlib
+import os
+from collections import Counter, defaultdict
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, router, transaction
+from django.db.models import F
+from django.db.models.deletion import Collector
+
+from . import usage
+from .models import Blob, Image
+
+
+READ_SIZE = 64 * 1024
+
+
+def digest(fh):
+    ##sha256 and length of a file, read in small pieces and rewound afterwards
+    sha256 = hashlib.sha256()
+    size = 0
+    fh.seek(0)
+    for chunk in iter(lambda: fh.read(READ_SIZE), b''):
+        sha256.update(chunk)
+        size += len(chunk)
+    fh.seek(0)
+    return sha256.hexdigest(), size
+
+
+def acquire(sha256):
+    ##takes a reference on already stored bytes, None when they were never stored
+    if Blob.objects.filter(sha256=sha256).update(refcount=F('refcount') + 1):
+        return Blob.objects.get(sha256=sha256)
+    return None
+
+
+def create(fh, sha256, size, filename, upload_to='images/', storage=None, dimensions=(None, None)):
+    ##saves new bytes under their hash with one reference taken; if a parallel upload of the
+    ##same bytes got there first this copy is dropped and theirs is shared instead
+    storage = storage or default_storage
+    ext = os.path.splitext(filename)[1].lower()
+    while True:
+        name = storage.save(f'{upload_to}{sha256}{ext}', fh if isinstance(fh, File) else File(fh))
+        try:
+            with transaction.atomic():
+                return Blob.objects.create(sha256=sha256, name=name, size=size, refcount=1,
+                                           width=dimensions[0], height=dimensions[1])
+        except IntegrityError:
+            storage.delete(name)
+            existing = acquire(sha256)
+            if existing is not None:
+                return existing
+            fh.seek(0)
+
+
+def store(fh, filename, upload_to='images/', storage=None):
+    sha256, size = digest(fh)
+    return (acquire(sha256) or create(fh, sha256, size, filename, upload_to, storage)).name
+
+
+def release(names):
+    ##drops one reference per name (a name may repeat) and returns the names nothing points at
+    ##any more, for storage.purge() to delete once the transaction is committed. files saved
+    ##before blobs existed have no row and are owned by their single image, so they are returned too
+    counts = Counter(name for name in names if name)
+    if not counts:
+        return []
+    with transaction.atomic():
+        refs = dict(Blob.objects.select_for_update().filter(name__in=list(counts)).values_list('name', 'refcount'))
+        free = [name for name in counts if name not in refs or refs[name] <= counts[name]]
+        Blob.objects.filter(name__in=free).delete()
+        by_count = defaultdict(list)
+        for name in refs:
+            if name not in free:
+                by_count[counts[name]].append(name)
+        for count, group in by_count.items():
+            Blob.objects.filter(name__in=group).update(refcount=F('refcount') - count)
+    return free
+
+
+def remove_images(images):
+    ##deletes pictures with their usage and blob references, in the caller's transaction. the rows
+    ##are locked first and only those still there are released, so two deletes of the same picture
+    ##(a double submitted ✖, a delete job run twice) give its reference back once.
+    ##returns the rows deleted and the names for storage.purge() once the transaction is committed
+    locked = list(images.select_for_update().order_by('id'))
+    if not locked:
+        return [], []
+    usage.remove(locked)
+    names = release([image.image.name for image in locked])
+    ##the rows in hand are deleted as they are, a queryset delete would select them again for the signals
+    collector = Collector(using=router.db_for_write(Image))
+    collector.collect(locked)
+    collector.delete()
+    return locked, names
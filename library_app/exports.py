@@ -0,0 +1,126 @@
+import logging
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import Image
+from .renditions import renditions_for
+
+
+logger = logging.getLogger(__name__)
+
+##storage reads running ahead of the one being written, memory is this many files whatever the album size
+PREFETCH = 4
+READ_SIZE = 64 * 1024
+##zip timestamps start in 1980, older capture dates are written as its first second
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+##rows fetched per query while walking the album
+BATCH = 200
+
+
+class _Sink:
+    ##write-only file the zip is written into, drained by the generator after every piece.
+    ##it has no seek(), so zipfile streams with data descriptors instead of rewriting headers
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def filename(album, size=None):
+    return f"{slugify(album.title) or 'album'}{'-' + size if size else ''}.zip"
+
+
+def entries(album, size=None):
+    ##(name in the archive, storage name, timestamp) of every ready picture in upload order, or of
+    ##its `size` jpeg rendition. rows are read in batches so the album is never loaded at once
+    images = Image.objects.filter(albums=album, status=Image.READY).exclude(image='').order_by('created_at', 'id')
+    folder = slugify(album.title) or 'album'
+    last = None
+    index = 0
+    while True:
+        batch = images
+        if last is not None:
+            batch = batch.filter(created_at__gte=last[0]).exclude(created_at=last[0], id__lte=last[1])
+        rows = list(batch.values_list('id', 'image', 'created_at', 'captured_at')[:BATCH])
+        if not rows:
+            return
+        found = renditions_for(name for _, name, _, _ in rows) if size else None
+        for id, name, created_at, captured_at in rows:
+            index += 1
+            if size:
+                rendition = found.get(name, {}).get(size)
+                if rendition is None:
+                    continue
+                name = rendition.file.name
+            yield f'{folder}/{index:05d}{os.path.splitext(name)[1].lower()}', name, captured_at or created_at
+        last = (rows[-1][2], rows[-1][0])
+
+
+def stream(album, size=None, storage=None):
+    ##the album as a zip, produced piece by piece for a StreamingHttpResponse or a file. pictures are
+    ##stored uncompressed (they already are compressed) and read PREFETCH ahead on a thread pool
+    storage = storage or default_storage
+    sink = _Sink()
+    archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True)
+    pool = ThreadPoolExecutor(max_workers=PREFETCH)
+    pending = deque()
+    missing = []
+    try:
+        queue = iter(entries(album, size))
+        for entry in queue:
+            pending.append((entry, pool.submit(storage.open, entry[1], 'rb')))
+            if len(pending) < PREFETCH:
+                continue
+            yield from _write(archive, sink, pending.popleft(), missing)
+        while pending:
+            yield from _write(archive, sink, pending.popleft(), missing)
+        if missing:
+            archive.writestr('missing.txt', '\n'.join(missing) + '\n')
+        archive.close()
+        yield sink.drain()
+    finally:
+        ##a client that goes away closes the generator here, files already opened ahead are let go
+        for _, future in pending:
+            if not future.cancel() and future.done() and future.exception() is None:
+                future.result().close()
+        pool.shutdown(wait=False)
+
+
+def _write(archive, sink, item, missing):
+    (arcname, name, taken), future = item
+    try:
+        source = future.result()
+    except Exception as error:
+        logger.warning('Export skipped %s: %s', name, error)
+        missing.append(name)
+        return
+    info = zipfile.ZipInfo(arcname, date_time=max(timezone.localtime(taken).timetuple()[:6], ZIP_EPOCH))
+    info.compress_type = zipfile.ZIP_STORED
+    with source, archive.open(info, 'w', force_zip64=True) as dest:
+        for chunk in iter(lambda: source.read(READ_SIZE), b''):
+            dest.write(chunk)
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
@@ -0,0 +1,126 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db.models import F
+from quartz_app import db
+from users_app.models import Profile
+
+from .models import Album
+
+
+##rendered grids are cached under the fragment_version of their album (or of the user's Profile
+##for the album list), which the post_save and post_delete receivers in library_app/signals.py bump,
+##so a write never has to find and delete the fragments it made stale, they just stop being asked for.
+##the versions live in the database, every process and replica sees a bump together with the rows it
+##was made for; the cache only holds html, a per-process cache is fine for it
+
+
+_local = threading.local()
+
+
+def get_cache():
+    return caches[settings.FRAGMENT_CACHE_ALIAS]
+
+
+def _versioned(kind):
+    ##the model holding a kind's versions and the field the ids are looked up by
+    if kind == 'album':
+        return Album.objects, 'id'
+    return Profile.objects, 'user_id'
+
+
+def version(kind, id):
+    ##callers holding the album or profile row pass its fragment_version to key() as current
+    rows, field = _versioned(kind)
+    current = rows.filter(**{field: id}).values_list('fragment_version', flat=True).first()
+    if current is None and kind == 'user':
+        current = Profile.objects.get_or_create(user_id=id)[0].fragment_version
+    return current
+
+
+def bump(kind, id):
+    ##inside the caller's transaction, so the new version commits with the rows it is for
+    rows, field = _versioned(kind)
+    rows.filter(**{field: id}).update(fragment_version=F('fragment_version') + 1)
+
+
+def invalidate_album(album):
+    pending = getattr(_local, 'pending', None)
+    for kind, id in (('album', album.id), ('user', album.user_id)):
+        if id is None:
+            continue
+        if pending is None:
+            bump(kind, id)
+        else:
+            pending.add((kind, id))
+
+
+@contextmanager
+def batched():
+    ##bulk deletes send a post_delete per picture, inside this block their bumps are
+    ##collected and made once per album and user when it ends (in the same transaction)
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+    _local.pending = set()
+    try:
+        yield
+        pending = _local.pending
+    finally:
+        _local.pending = None
+    for kind, id in sorted(pending):
+        bump(kind, id)
+
+
+def key(kind, id, *parts, current=None):
+    if current is None:
+        current = version(kind, id)
+    return ':'.join(['fragments', kind, str(id), str(current)] + [str(p) for p in parts])
+
+
+def cached(fragment_key, render):
+    cache = get_cache()
+    html = cache.get(fragment_key)
+    if html is None:
+        ##the key may come from a lagging replica, but what is stored under it is read from the
+        ##primary, so a fragment is never older than its version for the readers that share it
+        with db.primary():
+            html = render()
+        cache.set(fragment_key, html, settings.FRAGMENT_CACHE_TIMEOUT)
+    return html
+
+
+##django's file cache culls random entries once it is full, this one drops the least
+##recently read ones instead (reads bump the file's mtime)
+class LRUFileBasedCache(FileBasedCache):
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, default, version)
+        if value is not default:
+            try:
+                os.utime(self._key_to_file(key, version))
+            except FileNotFoundError:
+                pass
+        return value
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        num_entries = len(filelist)
+        if num_entries < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            return self.clear()
+        filelist.sort(key=_mtime)
+        for fname in filelist[:int(num_entries / self._cull_frequency)]:
+            self._delete(fname)
+
+
+def _mtime(fname):
+    try:
+        return os.path.getmtime(fname)
+    except FileNotFoundError:
+        return 0
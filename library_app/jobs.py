@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+from .storage import save_many
+
+
+logger = logging.getLogger(__name__)
+
+##kind -> function(job, **payload), filled in by library_app/tasks.py
+HANDLERS = {}
+
+##spooled uploads waiting for process_upload, in the media storage
+SPOOL_PREFIX = 'spool/'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def handler(kind):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, **payload):
+    ##the job row is the source of truth, the in-process pool only makes it start sooner.
+    ##anything the pool misses (a recycled or restarted worker, JOB_WORKERS = 0) is picked up
+    ##by manage.py process_jobs, the worker process of the Procfile
+    job = Job.objects.create(kind=kind, payload=json.dumps(payload))
+    if settings.JOB_WORKERS:
+        transaction.on_commit(lambda: _get_pool().submit(_run_in_thread, job.id))
+    return job
+
+
+def queued(kind, **payload):
+    ##whether the same job is already waiting or running, payloads are compared as stored
+    return Job.objects.filter(
+        kind=kind, payload=json.dumps(payload), status__in=[Job.QUEUED, Job.RUNNING]
+    ).exists()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.JOB_WORKERS, thread_name_prefix='jobs')
+        return _pool
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        job = claim(job_id)
+        if job is not None:
+            run(job)
+    finally:
+        connection.close()
+
+
+def claim(job_id):
+    ##compare-and-swap on the status so two workers never run the same job
+    claimed = Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+        status=Job.RUNNING,
+        started_at=timezone.now(),
+        attempts=F('attempts') + 1,
+    )
+    if not claimed:
+        return None
+    return Job.objects.get(id=job_id)
+
+
+def run(job):
+    func = HANDLERS[job.kind]
+    try:
+        func(job, **json.loads(job.payload))
+    except Exception:
+        logger.exception('Job %s failed', job)
+        job.error = traceback.format_exc()
+        job.status = Job.FAILED if job.attempts >= settings.JOB_MAX_ATTEMPTS else Job.QUEUED
+    else:
+        job.error = ''
+        job.status = Job.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    return job
+
+
+def pending(limit):
+    return list(
+        Job.objects.filter(status=Job.QUEUED).order_by('id').values_list('id', flat=True)[:limit]
+    )
+
+
+def run_pending(limit=100):
+    ##runs queued jobs in the calling thread, used by tests and the worker command
+    count = 0
+    for job_id in pending(limit):
+        job = claim(job_id)
+        if job is not None:
+            run(job)
+            count += 1
+    return count
+
+
+def progress(job, count):
+    ##moves started_at along with the progress, so requeue_stale only takes back a long job
+    ##(deleting a big album) once it has stopped making any
+    Job.objects.filter(id=job.id).update(progress=F('progress') + count, started_at=timezone.now())
+
+
+def requeue_stale(older_than):
+    ##jobs left running by a worker that died are handed out again
+    cutoff = timezone.now() - older_than
+    return Job.objects.filter(status=Job.RUNNING, started_at__lt=cutoff).update(status=Job.QUEUED)
+
+
+def spool(uploads):
+    ##parks uploads in the media storage under SPOOL_PREFIX, so whichever process claims the
+    ##job can read them and a restarted dyno does not lose them with its local disk. they are
+    ##written in parallel and before the caller opens its transaction, which must not stay open
+    ##(or hold the album's lock) across remote writes. resizing and the blob bookkeeping wait for the job
+    return save_many(
+        (f'{SPOOL_PREFIX}{uuid.uuid4().hex}{os.path.splitext(upload.name)[1].lower()}', upload)
+        for upload in uploads
+    )
+
+
+def discard(name):
+    try:
+        default_storage.delete(name)
+    except FileNotFoundError:
+        pass
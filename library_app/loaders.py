@@ -0,0 +1,17 @@
+from django.shortcuts import get_object_or_404
+
+from .models import Album, Image
+
+
+##lookups shared by the views. every one is scoped to the signed in user, so an id from
+##someone else's album is a 404 like a missing one, and each is a single query
+
+
+def user_album(user, id):
+    return get_object_or_404(Album.objects, id = id, user = user)
+
+
+def user_image(user, id):
+    ##the picture with its album joined in, for views that redirect or re-render the album
+    ##and for the signal receivers that invalidate its grids
+    return get_object_or_404(Image.objects.select_related('albums'), id = id, albums__user = user)
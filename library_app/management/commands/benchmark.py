@@ -0,0 +1,244 @@
+import itertools
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from library_app import fragments, jobs
+from library_app.models import Album, Image, Rendition
+from library_app.renditions import RENDITION_SIZES
+
+
+##a view is reported as regressed when its median grows by more than this factor
+##or it runs more queries than the baseline did
+DEFAULT_THRESHOLD = 1.25
+##medians of fewer runs than this are reported but not compared, a single run of the job
+##queue (the "(jobs)" rows) varies by more than the threshold; their query counts still are
+MIN_TIMED_SAMPLES = 5
+DEFAULT_OUTPUT = os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def make_jpeg(name, color):
+    buf = BytesIO()
+    PILImage.new('RGB', (640, 480), color).save(buf, 'JPEG')
+    return SimpleUploadedFile(name, buf.getvalue(), content_type='image/jpeg')
+
+
+##times the album and gallery request paths through the test client against a throwaway
+##database seeded with synthetic data, and compares the numbers with a saved baseline
+class Command(BaseCommand):
+    help = 'Benchmark the album and gallery views and save or compare a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=3)
+        parser.add_argument('--albums', type=int, default=10, help='Albums per user')
+        parser.add_argument('--images', type=int, default=200, help='Images per album')
+        parser.add_argument('--iterations', type=int, default=30, help='Requests timed per view')
+        parser.add_argument('--cold', action='store_true', help='Clear the fragment cache before every request')
+        parser.add_argument('--output', help='Where to write the results (default %s, '
+                                                 'nothing is written when comparing)' % DEFAULT_OUTPUT)
+        parser.add_argument('--compare', metavar='BASELINE',
+                            help='Compare with a saved baseline and exit with an error on regressions')
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+        parser.add_argument('--use-current-db', action='store_true',
+                            help='Seed the configured database instead of a temporary test database')
+        parser.add_argument('--storage', choices=['local', 'fake-s3'], default='local',
+                            help='Media backend, fake-s3 adds --latency to every storage request')
+        parser.add_argument('--latency', type=float, default=20.0,
+                            help='Milliseconds per fake-s3 request (default 20)')
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        overrides = override_settings(
+            DEFAULT_FILE_STORAGE=settings.STORAGE_BACKENDS[options['storage']],
+            FAKE_S3_LATENCY_MS=options['latency'],
+            STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+            MEDIA_ROOT=media_root,
+            UPLOAD_SPOOL_DIR=os.path.join(media_root, 'spool'),
+            JOB_WORKERS=0,
+            ##the login timings are about the queries around authentication, a full-strength
+            ##password hash would be most of each request and the same before and after
+            PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+        )
+        old_name = None
+        try:
+            setup_test_environment()
+            standalone = True
+        except RuntimeError:
+            ##already inside the test runner
+            standalone = False
+        try:
+            if not options['use_current_db']:
+                old_name = connection.settings_dict['NAME']
+                connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            with overrides:
+                results = self.run_suite(options)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            if standalone:
+                teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.report(results)
+        if options['compare']:
+            self.compare(results, options['compare'], options['threshold'])
+        output = options['output'] or (None if options['compare'] else DEFAULT_OUTPUT)
+        if output:
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            with open(output, 'w') as out:
+                json.dump(results, out, indent=2, sort_keys=True)
+                out.write('\n')
+            self.stdout.write(f'Saved results to {output}')
+
+    def run_suite(self, options):
+        fragments.get_cache().clear()
+        owner = self.seed(options['users'], options['albums'], options['images'])
+        album = Album.objects.filter(user=owner).order_by('id').first()
+        client = Client()
+        client.force_login(owner)
+        iterations = options['iterations']
+
+        views = {
+            'viewAlbums': self.measure(client, iterations, options['cold'],
+                                       lambda: client.get(reverse('view'))),
+            'viewPicturesByAlbum': self.measure(client, iterations, options['cold'],
+                                                lambda: client.get(reverse('pics', args=[album.id]))),
+            'viewGallery': self.measure(client, iterations, options['cold'],
+                                        lambda: client.get(reverse('gallery', args=[album.id]))),
+        }
+
+        uploads = itertools.count()
+        views['addImages'] = self.measure(client, iterations, options['cold'], lambda: client.post(
+            reverse('upload', args=[album.id]), {'image_file': self.upload_batch(next(uploads))},
+        ))
+        views['addImages (jobs)'] = self.measure(client, 1, False, lambda: jobs.run_pending(limit=iterations * 3))
+
+        ##a fresh client every time, so each request creates its session like a real sign in
+        credentials = {'username': owner.username, 'password': 'bench-password'}
+        views['login'] = self.measure(client, iterations, options['cold'],
+                                      lambda: Client().post(reverse('login'), credentials))
+
+        doomed = [self.seed_album(owner, f'Doomed {i}', options['images']) for i in range(iterations)]
+        targets = iter(doomed)
+        views['delete_album'] = self.measure(client, iterations, options['cold'],
+                                             lambda: client.post(reverse('delete_album', args=[next(targets).id])))
+        views['delete_album (jobs)'] = self.measure(client, 1, False, lambda: jobs.run_pending(limit=iterations))
+
+        return {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'users': options['users'],
+                'albums': options['albums'],
+                'images': options['images'],
+                'iterations': iterations,
+                'cold': options['cold'],
+                'storage': options['storage'],
+            },
+            'views': views,
+        }
+
+    def seed(self, users, albums, images):
+        ##rows only, the listing views never read the files behind them
+        owner = None
+        for u in range(users):
+            user = User.objects.create_user(f'bench{u}', f'bench{u}@example.com', 'bench-password')
+            owner = owner or user
+            for a in range(albums):
+                self.seed_album(user, f'Album {a}', images)
+        return owner
+
+    def seed_album(self, user, title, images):
+        album = Album.objects.create(title=title, user=user, album_cover=f'images/{user.id}_{title}.jpg')
+        created = Image.objects.bulk_create([
+            Image(albums=album, image=f'images/{album.id}_{i}.jpg', status=Image.READY)
+            for i in range(images)
+        ])
+        names = [album.album_cover.name] + [image.image.name for image in created]
+        Rendition.objects.bulk_create([
+            Rendition(source=name, size=size, file=f'renditions/{os.path.basename(name)}_{size}.jpg',
+                      width=width, height=height)
+            for name in names
+            for size, (width, height, crop) in RENDITION_SIZES.items()
+        ])
+        return album
+
+    def upload_batch(self, n):
+        ##distinct bytes every time, or blob dedup would skip the work being measured
+        return [make_jpeg(f'bench{n}_{i}.jpg', (n % 256, i * 40, 120)) for i in range(3)]
+
+    def measure(self, client, iterations, cold, request):
+        timings, queries, sizes = [], [], []
+        for _ in range(iterations):
+            if cold:
+                fragments.get_cache().clear()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = request()
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured))
+            content = getattr(response, 'content', b'')
+            sizes.append(len(content) if isinstance(content, bytes) else 0)
+            if getattr(response, 'status_code', 200) >= 400:
+                raise CommandError(f'Benchmark request failed with {response.status_code}')
+        return {
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p90_ms': round(percentile(timings, 90), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'max_ms': round(max(timings), 2),
+            'queries': int(percentile(queries, 50)),
+            'bytes': int(percentile(sizes, 50)),
+            'samples': len(timings),
+        }
+
+    def report(self, results):
+        self.stdout.write(f"{'view':<24}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'queries':>10}{'bytes':>10}")
+        for name, row in results['views'].items():
+            self.stdout.write(f"{name:<24}{row['p50_ms']:>10}{row['p90_ms']:>10}{row['p99_ms']:>10}"
+                              f"{row['queries']:>10}{row['bytes']:>10}")
+
+    def compare(self, results, path, threshold):
+        try:
+            with open(path) as fh:
+                baseline = json.load(fh)['views']
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f'Cannot read baseline {path}: {error}')
+
+        regressions = []
+        for name, row in results['views'].items():
+            old = baseline.get(name)
+            if old is None:
+                continue
+            if row['samples'] >= MIN_TIMED_SAMPLES and row['p50_ms'] > old['p50_ms'] * threshold:
+                regressions.append(f"{name}: p50 {old['p50_ms']}ms -> {row['p50_ms']}ms")
+            if row['queries'] > old['queries']:
+                regressions.append(f"{name}: {old['queries']} -> {row['queries']} queries")
+        for line in regressions:
+            self.stderr.write(self.style.WARNING(line))
+        if regressions:
+            raise CommandError(f'{len(regressions)} regressions against {path}')
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {path}'))
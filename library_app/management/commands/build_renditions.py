@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from library_app.models import Album, Image, Rendition
+from library_app.renditions import RENDITION_SIZES, formats, generate_renditions
+from library_app.storage import exists_many
+
+
+##backfills renditions for pictures uploaded before the rendition pipeline existed
+class Command(BaseCommand):
+    help = 'Generate missing renditions for album covers and images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate existing renditions too')
+        parser.add_argument('--verify', action='store_true',
+                            help='Also regenerate renditions whose files are gone from storage')
+
+    def handle(self, *args, **options):
+        files = [image.image for image in Image.objects.all()]
+        files += [album.album_cover for album in Album.objects.exclude(album_cover='').exclude(album_cover=None)]
+
+        done = set()
+        if not options['force']:
+            wanted = {(size, format) for size in RENDITION_SIZES for format in formats()}
+            complete = {}
+            for source, size, format in Rendition.objects.values_list('source', 'size', 'format'):
+                complete.setdefault(source, set()).add((size, format))
+            done = {name for name, sizes in complete.items() if sizes >= wanted}
+            if options['verify']:
+                stored = dict(Rendition.objects.values_list('file', 'source'))
+                lost = {stored[name] for name, found in exists_many(list(stored)).items() if not found}
+                self.stdout.write(f'{len(lost)} files have renditions missing from storage')
+                done -= lost
+
+        built = 0
+        for field_file in files:
+            if not field_file or field_file.name in done:
+                continue
+            try:
+                generate_renditions(field_file)
+            except Exception as error:
+                self.stderr.write(f'{field_file.name}: {error}')
+                continue
+            done.add(field_file.name)
+            built += 1
+        self.stdout.write(self.style.SUCCESS(f'Built renditions for {built} files'))
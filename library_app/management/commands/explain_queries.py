@@ -0,0 +1,63 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from library_app.models import Album, Image, Rendition
+from library_app.pagination import PAGE_SIZE, CursorPage
+from library_app.views import IMAGE_ORDERING, SORTS, album_images, album_overview
+
+
+##plan lines that mean a listing query is reading or sorting more than its page
+##(sqlite spells them SCAN/TEMP B-TREE, postgres Seq Scan/Sort)
+FULL_SCAN = re.compile(r'SCAN (TABLE )?library_app_|Seq Scan on library_app_|TEMP B-TREE FOR ORDER BY|^\W*Sort\b')
+
+
+##prints the plan of every listing query so index regressions show up in review
+class Command(BaseCommand):
+    help = 'Print EXPLAIN plans for the queries behind the album and gallery views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--album', type=int, help='Album to explain (defaults to the first one)')
+        parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (postgres only)')
+        parser.add_argument('--strict', action='store_true',
+                            help='Exit with an error if a plan scans or sorts a whole table')
+
+    def handle(self, *args, **options):
+        albums = Album.objects.order_by('id')
+        albums = albums.filter(id=options['album']) if options['album'] else albums
+        album = albums.first()
+        if album is None:
+            raise CommandError('No album to explain, create one or pass --album')
+
+        explain_options = {'analyze': True} if options['analyze'] else {}
+        flagged = []
+        for name, queryset in self.queries(album):
+            plan = queryset.explain(**explain_options)
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(plan + '\n')
+            if any(FULL_SCAN.search(line) for line in plan.splitlines()):
+                flagged.append(name)
+
+        for name in flagged:
+            self.stderr.write(self.style.WARNING(f'{name}: plan scans or sorts the whole table'))
+        if flagged and options['strict']:
+            raise CommandError(f'{len(flagged)} plans regressed')
+
+    def queries(self, album):
+        first = CursorPage(album_images(album), ordering=IMAGE_ORDERING)
+        ##the plan does not depend on where the cursor points, so any row will do
+        next_cursor = first.cursor_for(Image(id=0, created_at=timezone.now()))
+        later = CursorPage(album_images(album), next_cursor, ordering=IMAGE_ORDERING)
+        gallery = CursorPage(album_images(album, 'gallery'), ordering=IMAGE_ORDERING)
+        taken = {'sort': 'taken', 'from': timezone.now().date()}
+        by_date = CursorPage(album_images(album, options=taken), ordering=SORTS['taken'])
+        return [
+            ('viewAlbums', album_overview(album.user_id)),
+            ('viewPicturesByAlbum', first.queryset[:PAGE_SIZE + 1]),
+            ('viewPicturesByAlbum (next page)', later.queryset[:PAGE_SIZE + 1]),
+            ('viewGallery', gallery.queryset[:PAGE_SIZE + 1]),
+            ('viewPicturesByAlbum (by capture date)', by_date.queryset[:PAGE_SIZE + 1]),
+            ('renditions', Rendition.objects.filter(source__in=['images/a.jpg', 'images/b.jpg'])),
+        ]
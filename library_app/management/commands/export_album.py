@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from library_app import exports
+from library_app.models import Album
+from library_app.renditions import RENDITION_SIZES
+
+
+##the zip the album page streams (library_app/exports.py), written to a file for offline copies
+class Command(BaseCommand):
+    help = 'Write an album as a zip of its originals or of one rendition size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('album', type=int, help='Album id')
+        parser.add_argument('output', nargs='?', help='Zip file to write (default <album title>.zip)')
+        parser.add_argument('--size', choices=sorted(RENDITION_SIZES), help='Export this rendition instead of the originals')
+
+    def handle(self, *args, **options):
+        album = Album.objects.filter(id=options['album']).first()
+        if album is None:
+            raise CommandError(f"No album {options['album']}")
+        output = options['output'] or exports.filename(album, options['size'])
+
+        written = 0
+        with open(output, 'wb') as out:
+            for piece in exports.stream(album, options['size']):
+                out.write(piece)
+                written += len(piece)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {album.title} to {output} ({written} bytes)'))
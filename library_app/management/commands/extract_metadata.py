@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from library_app import fragments, metadata
+from library_app.models import Album, Image
+
+
+##reads exif and the other columns of library_app/metadata.py for pictures stored before they
+##were extracted at upload. the album views queue the same work per album on first use
+class Command(BaseCommand):
+    help = 'Extract capture time, camera, orientation and colour for images that have none'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--album', type=int, help='Only this album')
+        parser.add_argument('--batch', type=int, default=metadata.BATCH, help='Images read per round')
+        parser.add_argument('--limit', type=int, help='Stop after this many images')
+
+    def handle(self, *args, **options):
+        missing = Image.objects.filter(metadata_at__isnull=True).exclude(image='')
+        if options['album']:
+            missing = missing.filter(albums=options['album'])
+
+        done = 0
+        while options['limit'] is None or done < options['limit']:
+            size = options['batch'] if options['limit'] is None else min(options['batch'], options['limit'] - done)
+            batch = list(missing.order_by('id').only('id', 'image', 'metadata_at', 'albums')[:size])
+            if not batch:
+                break
+            filled = metadata.backfill(batch)
+            for album in Album.objects.filter(id__in={image.albums_id for image in batch}):
+                fragments.invalidate_album(album)
+            done += len(batch)
+            self.stdout.write(f'{done} images read')
+            if not filled:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f'Extracted metadata for {done} images'))
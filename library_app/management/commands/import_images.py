@@ -0,0 +1,251 @@
+import hashlib
+import os
+import tarfile
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+
+from library_app import fragments, metadata, uploads, usage
+from library_app.models import Album, Blob, Image, Rendition
+from library_app.renditions import ENCODINGS, RENDITION_SIZES, decode, encode, formats, resize
+from library_app.storage import delete_many, hashed_name
+
+
+EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+
+
+def read_entries(path):
+    ##(name, bytes) of every picture in a directory, zip or tar, one entry in memory at a time.
+    ##tars are read as a stream, so even a compressed one is never unpacked to disk
+    def wanted(name):
+        return os.path.splitext(name)[1].lower() in EXTENSIONS and not os.path.basename(name).startswith('.')
+
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if wanted(name):
+                    with open(os.path.join(root, name), 'rb') as fh:
+                        yield os.path.relpath(os.path.join(root, name), path), fh.read()
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and wanted(info.filename):
+                    yield info.filename, archive.read(info)
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and wanted(member.name):
+                    yield member.name, archive.extractfile(member).read()
+    else:
+        raise CommandError(f'{path} is not a directory, zip or tar archive')
+
+
+def prepare(entry, formats=('jpeg',)):
+    ##decodes, resizes and encodes one picture, runs in the process pool so it must not touch the db
+    name, data, sha256 = entry
+    try:
+        img = decode(BytesIO(data))
+        values = metadata.extract(BytesIO(data), img)
+    except Exception as error:
+        return {'name': name, 'sha256': sha256, 'error': str(error)}
+    renditions = {}
+    for size, (width, height, crop) in RENDITION_SIZES.items():
+        resized = resize(img, width, height, crop)
+        for format in formats:
+            renditions[size, format] = (encode(resized, format), resized.width, resized.height)
+    return {
+        'name': name,
+        'sha256': sha256,
+        'width': img.width,
+        'height': img.height,
+        'metadata': values,
+        'renditions': renditions,
+    }
+
+
+##imports a directory or archive into an album without going through the browser: pictures
+##are hashed first so bytes already stored are shared (library_app/blobs.py), the rest are
+##decoded and resized in a process pool, uploaded by a bounded thread pool and inserted in batches
+class Command(BaseCommand):
+    help = 'Import every picture in a directory, zip or tar archive into an album'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('album', help='Album id or title')
+        parser.add_argument('path')
+        parser.add_argument('--create-album', action='store_true', help='Create the album if no album has that title')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='Decoding processes, 0 decodes in this process')
+        parser.add_argument('--concurrency', type=int, default=8, help='Storage uploads at a time')
+        parser.add_argument('--batch', type=int, default=50,
+                            help='Pictures read, processed and inserted together (bounds memory)')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user {options['username']}")
+        album = self.get_album(user, options['album'], options['create_album'])
+        if not os.path.exists(options['path']):
+            raise CommandError(f"{options['path']} does not exist")
+
+        pool = None
+        if options['processes'] > 0:
+            ##forked children must not inherit open database connections
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=options['processes'])
+        uploader = ThreadPoolExecutor(max_workers=options['concurrency'])
+        totals = Counter()
+        try:
+            batch = []
+            for entry in read_entries(options['path']):
+                batch.append(entry)
+                if len(batch) >= options['batch']:
+                    totals.update(self.import_batch(album, batch, pool, uploader))
+                    batch = []
+            if batch:
+                totals.update(self.import_batch(album, batch, pool, uploader))
+        finally:
+            uploader.shutdown()
+            if pool is not None:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {totals['imported']} pictures into {album.title} "
+            f"({totals['duplicates']} already stored, {totals['failed']} failed, {totals['skipped']} too large)"
+        ))
+
+    def get_album(self, user, album, create):
+        albums = Album.objects.filter(user=user)
+        found = albums.filter(id=int(album)).first() if album.isdigit() else None
+        found = found or albums.filter(title=album).order_by('id').first()
+        if found is None:
+            if not create:
+                raise CommandError(f'{user.username} has no album {album}, pass --create-album to make it')
+            found = Album.objects.create(user=user, title=album)
+        return found
+
+    def import_batch(self, album, entries, pool, uploader):
+        ##like the upload views, nothing is added to an album the delete job is removing
+        self.check_album(album)
+        totals = Counter()
+        hashed = []
+        for name, data in entries:
+            if len(data) > settings.UPLOAD_MAX_SIZE:
+                self.stderr.write(f'{name}: larger than UPLOAD_MAX_SIZE')
+                totals['skipped'] += 1
+                continue
+            hashed.append((name, data, hashlib.sha256(data).hexdigest()))
+
+        known = set(Blob.objects.filter(sha256__in={sha for _, _, sha in hashed}).values_list('sha256', flat=True))
+        todo, seen = [], set(known)
+        for name, data, sha256 in hashed:
+            if sha256 not in seen:
+                seen.add(sha256)
+                todo.append((name, data, sha256))
+        sizes = {sha256: len(data) for _, data, sha256 in hashed}
+        work = partial(prepare, formats=formats())
+        prepared = list(pool.map(work, todo) if pool is not None else map(work, todo))
+
+        failed = set()
+        for result in prepared:
+            if 'error' in result:
+                self.stderr.write(f"{result['name']}: {result['error']}")
+                failed.add(result['sha256'])
+        prepared = [result for result in prepared if 'error' not in result]
+        data = {sha256: payload for _, payload, sha256 in todo}
+        values = {result['sha256']: result['metadata'] for result in prepared}
+        stored = list(uploader.map(lambda result: self.upload(result, data[result['sha256']]), prepared))
+
+        try:
+            with transaction.atomic():
+                uploads.lock_album(album.id)
+                images = self.insert(album, hashed, prepared, stored, sizes, failed, values)
+        except uploads.UploadError:
+            ##marked for deletion while this batch was uploading, its new files go with it
+            delete_many([name for original, renditions in stored for name in [original, *renditions.values()]])
+            raise CommandError(f'{album.title} is being deleted')
+        ##bulk_create sends no post_save, so the cached grids are retired here
+        fragments.invalidate_album(album)
+
+        totals['imported'] += len(images)
+        totals['duplicates'] += len(images) - len(prepared)
+        totals['failed'] += sum(1 for _, _, sha256 in hashed if sha256 in failed)
+        self.stdout.write(f'{len(images)} pictures imported from this batch')
+        return totals
+
+    def check_album(self, album):
+        try:
+            with transaction.atomic():
+                uploads.lock_album(album.id)
+        except uploads.UploadError:
+            raise CommandError(f'{album.title} is being deleted')
+
+    def insert(self, album, hashed, prepared, stored, sizes, failed, values):
+        ##blob references, rows and usage of one batch, in the caller's transaction
+        blobs = {
+            result['sha256']: self.claim(result, names, sizes[result['sha256']])
+            for result, names in zip(prepared, stored)
+        }
+        counts = Counter(sha256 for _, _, sha256 in hashed if sha256 not in failed)
+        blobs.update({blob.sha256: blob for blob in Blob.objects.filter(sha256__in=set(counts) - set(blobs))})
+        ##a stored blob released by a delete since the lookup above is gone, its pictures are left out
+        counts = {sha256: count for sha256, count in counts.items() if sha256 in blobs}
+        for sha256, count in counts.items():
+            Blob.objects.filter(sha256=sha256).update(refcount=F('refcount') + count)
+        images = [blobs[sha256] for _, _, sha256 in hashed if sha256 in counts]
+        ##pictures already stored take the metadata read when they were first seen
+        for sha256 in set(counts) - set(values):
+            values[sha256] = metadata.known(blobs[sha256].name) or {}
+        Image.objects.bulk_create([
+            Image(albums=album, image=blob.name, status=Image.READY, size=blob.size,
+                  **dict({'width': blob.width, 'height': blob.height}, **values[blob.sha256]))
+            for blob in images
+        ])
+        usage.add(album.id, len(images), sum(blob.size for blob in images))
+        return images
+
+    def upload(self, result, data):
+        ##original and renditions of one new picture, on the uploader pool
+        ext = os.path.splitext(result['name'])[1].lower()
+        original = default_storage.save(f"images/{result['sha256']}{ext}", ContentFile(data))
+        field = Rendition._meta.get_field('file')
+        renditions = {
+            (size, format): field.storage.save(
+                field.generate_filename(None, hashed_name(f"{result['sha256']}_{size}.{ENCODINGS[format][0]}", encoded)),
+                ContentFile(encoded))
+            for (size, format), (encoded, width, height) in result['renditions'].items()
+        }
+        return original, renditions
+
+    def claim(self, result, names, size):
+        ##the blob row of a freshly uploaded picture, created without references (import_batch
+        ##adds them), or the one a parallel upload of the same bytes created first, in which
+        ##case this copy is thrown away
+        original, renditions = names
+        try:
+            with transaction.atomic():
+                blob = Blob.objects.create(sha256=result['sha256'], name=original, size=size, refcount=0,
+                                           width=result['width'], height=result['height'])
+        except IntegrityError:
+            default_storage.delete(original)
+            for name in renditions.values():
+                default_storage.delete(name)
+            return Blob.objects.get(sha256=result['sha256'])
+        Rendition.objects.bulk_create([
+            Rendition(source=original, size=size_name, format=format, file=name,
+                      width=result['renditions'][size_name, format][1], height=result['renditions'][size_name, format][2])
+            for (size_name, format), name in renditions.items()
+        ])
+        return blob
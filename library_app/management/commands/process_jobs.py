@@ -0,0 +1,76 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from library_app import jobs, uploads
+
+
+##seconds between two looks for jobs left running by a dead worker (see --stale-after)
+REQUEUE_EVERY = 60
+
+
+##the worker process of the Procfile. it runs whatever the web processes' job pools lost
+##(a recycled or restarted worker drops its queue), and hands out again jobs left running
+class Command(BaseCommand):
+    help = 'Run queued background jobs (uploads, renditions)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--poll', type=float, default=2.0, help='Seconds to sleep when idle')
+        parser.add_argument('--stale-after', type=int, default=30,
+                            help='Minutes after which a running job is considered abandoned')
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(minutes=options['stale_after'])
+        self.requeue(stale_after)
+        expired = uploads.expire(timedelta(hours=settings.UPLOAD_SESSION_HOURS))
+        if expired:
+            self.stdout.write(f'Removed {expired} abandoned uploads')
+
+        workers = options['workers']
+        pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        done = 0
+        requeued_at = time.monotonic()
+        try:
+            while True:
+                close_old_connections()
+                if time.monotonic() - requeued_at >= REQUEUE_EVERY:
+                    self.requeue(stale_after)
+                    requeued_at = time.monotonic()
+                batch = jobs.pending(workers * 4)
+                if batch:
+                    if pool is None:
+                        done += sum(self.run_one(job_id) for job_id in batch)
+                    else:
+                        done += sum(pool.map(self.run_in_thread, batch))
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll'])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(f'Ran {done} jobs'))
+
+    def requeue(self, stale_after):
+        requeued = jobs.requeue_stale(stale_after)
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale jobs')
+
+    def run_one(self, job_id):
+        job = jobs.claim(job_id)
+        if job is None:
+            return 0
+        jobs.run(job)
+        return 1
+
+    def run_in_thread(self, job_id):
+        try:
+            return self.run_one(job_id)
+        finally:
+            connection.close()
@@ -0,0 +1,73 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from users_app.models import Profile
+
+from library_app.models import Album, Blob, Image
+
+
+##rebuilds the Album and Profile usage counters (library_app/usage.py) from the images table with
+##one UPDATE each, after backfilling the sizes of pictures stored before sizes were recorded
+class Command(BaseCommand):
+    help = 'Recompute the per-album and per-user image and byte counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report counters that are off')
+        parser.add_argument('--fetch-sizes', action='store_true',
+                            help='Ask the storage backend for sizes the blob table does not know')
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            self.backfill_sizes(options['fetch_sizes'])
+
+        stored = Image.objects.exclude(image='').order_by()
+        by_album = stored.filter(albums=OuterRef('pk')).values('albums')
+        by_user = stored.filter(albums__user=OuterRef('user')).values('albums__user')
+        targets = [
+            ('albums', Album.objects.all(), by_album),
+            ('profiles', Profile.objects.all(), by_user),
+        ]
+
+        for label, queryset, images in targets:
+            actual = {
+                'image_count': Coalesce(Subquery(images.annotate(n=Count('id')).values('n'),
+                                                 output_field=IntegerField()), 0),
+                'bytes_used': Coalesce(Subquery(images.annotate(n=Sum('size')).values('n'),
+                                                output_field=IntegerField()), 0),
+            }
+            drifted = self.drifted(queryset, actual)
+            if options['dry_run']:
+                self.stdout.write(f'{drifted} {label} have counters that are off')
+                continue
+            with transaction.atomic():
+                updated = queryset.update(**actual)
+            self.stdout.write(f'Recomputed {updated} {label}, {drifted} were off')
+
+    def drifted(self, queryset, actual):
+        annotated = queryset.annotate(actual_count=actual['image_count'], actual_bytes=actual['bytes_used'])
+        return sum(
+            1 for count, size, actual_count, actual_bytes in annotated.values_list(
+                'image_count', 'bytes_used', 'actual_count', 'actual_bytes').iterator()
+            if (count, size) != (actual_count, actual_bytes)
+        )
+
+    def backfill_sizes(self, fetch):
+        ##pictures stored through the blob table get their size from it in one UPDATE
+        blob = Blob.objects.filter(name=OuterRef('image'))
+        missing = Image.objects.filter(size=0).exclude(image='')
+        missing.filter(image__in=Blob.objects.values('name')).update(
+            size=Subquery(blob.values('size')[:1]),
+            width=Subquery(blob.values('width')[:1]),
+            height=Subquery(blob.values('height')[:1]),
+        )
+        if not fetch:
+            return
+        for image in missing.filter(size=0).only('id', 'image'):
+            try:
+                size = default_storage.size(image.image.name)
+            except Exception as error:
+                self.stderr.write(f'{image.image.name}: {error}')
+                continue
+            Image.objects.filter(id=image.id).update(size=size)
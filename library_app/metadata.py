@@ -0,0 +1,104 @@
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from .models import Image
+from .renditions import decode, preview_uri
+
+
+##exif tags read from the original (pillow's numbering)
+DATETIME_ORIGINAL = 36867
+DATETIME = 306
+ORIENTATION = 274
+MAKE = 271
+MODEL = 272
+
+##images read per round of the backfill
+BATCH = 100
+
+##columns on Image filled in by extract(), see Image.metadata_at
+FIELDS = ('captured_at', 'camera', 'orientation', 'dominant_color', 'preview', 'width', 'height', 'metadata_at')
+
+
+def read_exif(img):
+    ##_getexif merges the exif sub-ifd (where the capture time lives) on the pillow we pin
+    try:
+        exif = img._getexif() if hasattr(img, '_getexif') else None
+    except Exception:
+        exif = None
+    if exif is None:
+        exif = dict(img.getexif())
+    return exif or {}
+
+
+def parse_exif_time(value):
+    if not isinstance(value, str):
+        return None
+    try:
+        taken = datetime.strptime(value.strip('\x00 ')[:19], '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    ##exif times carry no zone, they are read as the site's
+    return timezone.make_aware(taken)
+
+
+def dominant_color(img):
+    small = img.convert('RGB')
+    small.thumbnail((64, 64))
+    quantized = small.quantize(colors=5)
+    count, index = max(quantized.getcolors())
+    red, green, blue = quantized.getpalette()[index * 3:index * 3 + 3]
+    return f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def extract(fh, img=None):
+    ##metadata of one original. fh is read for the exif block only, pass the decoded and
+    ##transposed img when the caller has it to skip decoding the pixels a second time
+    fh.seek(0)
+    raw = PILImage.open(fh)
+    exif = read_exif(raw)
+    if img is None:
+        fh.seek(0)
+        img = decode(fh)
+    camera = ' '.join(str(exif.get(tag, '')).strip('\x00 ') for tag in (MAKE, MODEL)).strip()
+    orientation = exif.get(ORIENTATION)
+    return {
+        'captured_at': parse_exif_time(exif.get(DATETIME_ORIGINAL)) or parse_exif_time(exif.get(DATETIME)),
+        'camera': camera[:100],
+        'orientation': orientation if isinstance(orientation, int) else None,
+        'dominant_color': dominant_color(img),
+        'preview': preview_uri(img),
+        'width': img.width,
+        'height': img.height,
+        'metadata_at': timezone.now(),
+    }
+
+
+def known(name):
+    ##metadata already extracted for the same bytes (blob dedup) under another Image row
+    return Image.objects.filter(image=name, metadata_at__isnull=False).values(*FIELDS).first()
+
+
+def backfill(images):
+    ##extracts metadata for images that have none, reading each original from storage once
+    ##and copying it to every row that shares the file. returns how many rows were filled
+    by_name = {}
+    for image in images:
+        if image.image and image.metadata_at is None:
+            by_name.setdefault(image.image.name, []).append(image.id)
+    done = 0
+    for name, ids in by_name.items():
+        values = known(name)
+        if values is None:
+            field_file = Image(image=name).image
+            try:
+                with field_file.open('rb') as fh:
+                    values = extract(fh)
+            except Exception:
+                ##an original that cannot be read is marked done, it would fail every time
+                values = {'metadata_at': timezone.now()}
+        with transaction.atomic():
+            done += Image.objects.filter(id__in=ids, metadata_at__isnull=True).update(**values)
+    return done
@@ -0,0 +1,37 @@
+# Generated by Django 3.0.3 on 2026-10-18 02:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0014_remove_image_user'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='album',
+            name='album_cover',
+            field=models.ImageField(blank=True, null=True, upload_to='images/'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(upload_to='images/'),
+        ),
+        migrations.CreateModel(
+            name='Rendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(db_index=True, max_length=255)),
+                ('size', models.CharField(max_length=20)),
+                ('file', models.ImageField(upload_to='renditions/')),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+            ],
+            options={
+                'unique_together': {('source', 'size')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.3 on 2026-10-18 02:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0022_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rendition',
+            name='format',
+            field=models.CharField(default='jpeg', max_length=4),
+        ),
+        migrations.AlterUniqueTogether(
+            name='rendition',
+            unique_together={('source', 'size', 'format')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 02:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0023_rendition_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='preview',
+            field=models.TextField(blank=True),
+        ),
+    ]
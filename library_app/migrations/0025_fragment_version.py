@@ -0,0 +1,19 @@
+# Generated by Django 3.0.3 on 2026-10-18 03:32
+
+from django.db import migrations, models
+import library_app.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0024_image_preview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='fragment_version',
+            field=models.BigIntegerField(default=library_app.models.fragment_version),
+        ),
+    ]
@@ -1,13 +1,56 @@
+import os
+import time
+import uuid
+
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 from django.contrib import admin
 import PIL
 from PIL import Image
 
-class Album(models.Model):
+
+def fragment_version():
+    ##starting value of the versions library_app/fragments.py keys cached grids on, a timestamp
+    ##so an album that gets the id of a deleted one never picks up the deleted one's fragments
+    return int(time.time() * 1000)
+
+
+##usage counters are only ever changed with F() updates (library_app/usage.py) and rebuilt by
+##manage.py reconcile_usage; a plain save() of a model loaded earlier must not write them back
+class CounterFieldsMixin:
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if self.pk and not self._state.adding and not kwargs.get('update_fields') and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class Album(CounterFieldsMixin, models.Model):
     title = models.CharField(max_length=60)
     album_cover = models.ImageField(upload_to="images/",  blank=True, null=True, )
     user = models.ForeignKey(User, on_delete = models.CASCADE, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    ##set while the delete_album job is removing the pictures
+    deleting = models.BooleanField(default=False)
+    ##stored pictures and their bytes, see CounterFieldsMixin
+    image_count = models.PositiveIntegerField(default=0)
+    bytes_used = models.BigIntegerField(default=0)
+    ##bumped with every change to the album or its pictures, see library_app/fragments.py
+    fragment_version = models.BigIntegerField(default=fragment_version)
+
+    counter_fields = ('image_count', 'bytes_used', 'fragment_version')
+
+    ##listings are "albums of a user in creation order", see manage.py explain_queries
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='album_user_created_idx'),
+        ]
 
     # public = models.BooleanField(default=False)
     def __str__(self):
@@ -24,9 +67,42 @@ class Album(models.Model):
 
 
 class Image(models.Model):
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
+
     title = models.CharField(max_length=60, blank=True, null=True)
     image = models.ImageField(upload_to="images/" )
     albums = models.ForeignKey(Album, on_delete = models.CASCADE, blank=True)
+    ##uploads stay pending until the job queue has stored the file and built its renditions
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=READY)
+    ##of the original, filled in when the job stores it
+    size = models.BigIntegerField(default=0)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    ##read from the original once (library_app/metadata.py), metadata_at is set when that happened.
+    ##captured_at is the exif capture time, null when the camera did not record one
+    captured_at = models.DateTimeField(null=True, blank=True)
+    camera = models.CharField(max_length=100, blank=True)
+    orientation = models.PositiveSmallIntegerField(null=True, blank=True)
+    dominant_color = models.CharField(max_length=7, blank=True)
+    ##blur-up placeholder as a data uri, inlined by the picture tag so it needs no request
+    preview = models.TextField(blank=True)
+    metadata_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    ##match the keyset orderings of the album pages (library_app/pagination.py)
+    class Meta:
+        indexes = [
+            models.Index(fields=['albums', 'created_at', 'id'], name='image_album_created_idx'),
+            models.Index(fields=['albums', 'captured_at', 'id'], name='image_album_captured_idx'),
+        ]
 
     def __str__(self):
         return self.image.name
@@ -45,3 +121,85 @@ class Image(models.Model):
     #     rgb_im.save(self.image.path)
 
 
+##resized copies of an uploaded picture, keyed by the storage name of the original
+##so album covers and gallery images share the same table
+class Rendition(models.Model):
+    source = models.CharField(max_length=255, db_index=True)
+    size = models.CharField(max_length=20)
+    ##one row per encoding of a size, see ENCODINGS in library_app/renditions.py
+    format = models.CharField(max_length=4, default='jpeg')
+    file = models.ImageField(upload_to="renditions/")
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('source', 'size', 'format')
+
+    def __str__(self):
+        return f'{self.source} ({self.size}, {self.format})'
+
+
+##work handed off from the request cycle, see library_app/jobs.py
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=40)
+    payload = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    ##units of work done / expected, for jobs that report it
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        if self.total:
+            return f'{self.kind} #{self.id} ({self.status}, {self.progress}/{self.total})'
+        return f'{self.kind} #{self.id} ({self.status})'
+
+
+##a chunked upload in progress (library_app/uploads.py), the bytes received so far
+##sit in a .part file in UPLOAD_SPOOL_DIR until the client finishes it
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    albums = models.ForeignKey(Album, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def path(self):
+        return os.path.join(settings.UPLOAD_SPOOL_DIR, f'{self.id.hex}.part')
+
+    def __str__(self):
+        return f'{self.filename} ({self.received}/{self.size})'
+
+
+##uploaded originals stored once per distinct content (library_app/blobs.py): images and album
+##covers with the same bytes point at the same storage name, which is deleted with its last reference
+class Blob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount} refs)'
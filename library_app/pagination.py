@@ -0,0 +1,84 @@
+import base64
+import json
+from functools import reduce
+
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+PAGE_SIZE = 48
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+##keyset pagination: the cursor holds the ordering values of the last row served and the
+##next page filters past them, so every page costs the same however deep the user scrolls.
+##the ordering has to end in a unique field (id) to stay stable
+class CursorPage:
+
+    def __init__(self, queryset, cursor=None, size=PAGE_SIZE, ordering=('id',)):
+        self.ordering = ordering
+        self.size = size
+        self.queryset = queryset.order_by(*ordering)
+        if cursor:
+            self.queryset = self.queryset.filter(self._after(self._decode(cursor)))
+
+    ##rows are only fetched when the template first looks at them
+    @cached_property
+    def _rows(self):
+        return list(self.queryset[:self.size + 1])
+
+    @property
+    def items(self):
+        return self._rows[:self.size]
+
+    @property
+    def has_next(self):
+        return len(self._rows) > self.size
+
+    @property
+    def next_cursor(self):
+        if not self.has_next:
+            return None
+        return self.cursor_for(self.items[-1])
+
+    def cursor_for(self, obj):
+        values = [self._field(name).value_to_string(obj) for name in self._names]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def _names(self):
+        return [name.lstrip('-') for name in self.ordering]
+
+    def _field(self, name):
+        return self.queryset.model._meta.get_field(name)
+
+    def _decode(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [self._field(name).to_python(value) for name, value in zip(self._names, values)]
+        except Exception:
+            raise InvalidCursor(cursor)
+
+    def _after(self, values):
+        ##(a, b, id) > (x, y, z) spelled out as a > x OR (a = x AND b > y) OR ...
+        clauses = []
+        for i, name in enumerate(self.ordering):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            equal = {prev.lstrip('-'): values[j] for j, prev in enumerate(self.ordering[:i])}
+            clauses.append(Q(**equal) & Q(**{f'{field}__{lookup}': values[i]}))
+        ##the redundant bound on the first column lets the index seek instead of filter
+        first = self.ordering[0]
+        bound = Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]})
+        return bound & reduce(lambda a, b: a | b, clauses)
@@ -0,0 +1,202 @@
+import base64
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.templatetags.static import static
+from PIL import Image as PILImage, ImageOps
+
+from .models import Rendition
+from .storage import hashed_name, purge, save_many
+
+
+##every upload is resized once into these sizes: name -> (width, height, crop)
+##tile feeds the 200x200 grid, gallery the masonry view and lightbox the baguetteBox overlay,
+##the others are the width steps offered next to them in srcset
+RENDITION_SIZES = {
+    'tile': (200, 200, True),
+    'tile_2x': (400, 400, True),
+    'small': (400, 400, False),
+    'gallery': (800, 800, False),
+    'large': (1200, 1200, False),
+    'lightbox': (1600, 1600, False),
+}
+
+##the sizes a browser can choose between when a template asks for one of them
+SRCSETS = {
+    'tile': ('tile', 'tile_2x'),
+    'gallery': ('small', 'gallery', 'large', 'lightbox'),
+    'lightbox': ('small', 'gallery', 'large', 'lightbox'),
+}
+
+##format -> (file extension, mime type, pillow encoder options). jpeg is always stored,
+##it is the <img> fallback and what the rendition filter links
+ENCODINGS = {
+    'avif': ('avif', 'image/avif', {'quality': 60, 'speed': 8}),
+    'webp': ('webp', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', 'image/jpeg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+##shown while a picture has no rendition yet, the templates never link the original
+PLACEHOLDER = 'img/processing.svg'
+
+##longest side of the inline blur-up preview kept on each Image, a few hundred bytes as a data uri
+PREVIEW_SIZE = 16
+
+
+def decode(fh):
+    img = PILImage.open(fh)
+    img.load()
+    return ImageOps.exif_transpose(img).convert('RGB')
+
+
+def open_image(field_file):
+    field_file.open('rb')
+    try:
+        return decode(field_file)
+    finally:
+        field_file.close()
+
+
+def resize(img, width, height, crop=False):
+    if crop:
+        return ImageOps.fit(img, (width, height), PILImage.LANCZOS)
+    img = img.copy()
+    img.thumbnail((width, height), PILImage.LANCZOS)
+    return img
+
+
+def preview_uri(img):
+    ##tiny jpeg the browser scales up (which blurs it) while the real rendition loads
+    small = img.copy()
+    small.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE), PILImage.BILINEAR)
+    buf = BytesIO()
+    small.save(buf, 'JPEG', quality=40)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buf.getvalue()).decode()
+
+
+def formats():
+    ##RENDITION_FORMATS the installed pillow can write (avif needs pillow 11.2 or the avif plugin), then jpeg
+    PILImage.init()
+    modern = [f for f in settings.RENDITION_FORMATS if f in ENCODINGS and f != 'jpeg' and f.upper() in PILImage.SAVE]
+    return modern + ['jpeg']
+
+
+def encode(img, format):
+    buf = BytesIO()
+    img.save(buf, format.upper(), **ENCODINGS[format][2])
+    return buf.getvalue()
+
+
+def _render(img, base, size, spec, formats):
+    ##resize once and encode every format of one size; runs on a pool thread and never touches the db
+    width, height, crop = spec
+    resized = resize(img, width, height, crop)
+    field = Rendition._meta.get_field('file')
+    renditions = []
+    for format in formats:
+        encoded = encode(resized, format)
+        filename = field.generate_filename(None, hashed_name(f'{base}_{size}.{ENCODINGS[format][0]}', encoded))
+        rendition = Rendition(source='', size=size, format=format, width=resized.width, height=resized.height)
+        renditions.append((rendition, filename, encoded))
+    return renditions
+
+
+def generate_renditions(field_file, sizes=None, img=None, encodings=None):
+    ##decodes the original once and stores every format of each size (or only `encodings`),
+    ##replacing older ones. pass an already decoded img to skip reading the original back from storage.
+    ##the sizes are resized and encoded in parallel (pillow lets go of the gil while it
+    ##resamples and encodes) and the files uploaded together by storage.save_many, rows are written here
+    sizes = sizes or RENDITION_SIZES
+    if img is None:
+        img = open_image(field_file)
+    base = os.path.splitext(os.path.basename(field_file.name))[0]
+    wanted = encodings or formats()
+    with ThreadPoolExecutor(max_workers=len(sizes)) as pool:
+        rendered = [item for group in pool.map(lambda item: _render(img, base, *item, wanted), sizes.items())
+                    for item in group]
+    names = save_many(
+        ((filename, ContentFile(encoded)) for _, filename, encoded in rendered),
+        storage=Rendition._meta.get_field('file').storage,
+    )
+    renditions = [rendition for rendition, _, _ in rendered]
+    with transaction.atomic():
+        old = dict(Rendition.objects.filter(source=field_file.name, size__in=list(sizes)).values_list('id', 'file'))
+        if old:
+            Rendition.objects.filter(id__in=list(old)).delete()
+        for rendition, name in zip(renditions, names):
+            rendition.source = field_file.name
+            rendition.file = name
+            rendition.save()
+    ##files of the replaced rows go once the new ones are committed, except those with the
+    ##same bytes as a new rendition (and so the same name)
+    replaced = set(old.values()) - set(names)
+    if replaced:
+        replaced -= set(Rendition.objects.filter(file__in=replaced).values_list('file', flat=True))
+        purge(replaced)
+    return renditions
+
+
+def missing_sizes(name):
+    ##sizes an original still lacks in some format, empty when its bytes were already processed for another upload
+    done = set(Rendition.objects.filter(source=name).values_list('size', 'format'))
+    wanted = formats()
+    return {
+        size: spec for size, spec in RENDITION_SIZES.items()
+        if any((size, format) not in done for format in wanted)
+    }
+
+
+def renditions_for(names):
+    ##name -> {size: jpeg rendition, (size, format): rendition} for any number of originals in a single query
+    names = {name for name in names if name}
+    found = {name: {} for name in names}
+    if names:
+        for rendition in Rendition.objects.filter(source__in=names):
+            found[rendition.source][(rendition.size, rendition.format)] = rendition
+            if rendition.format == 'jpeg':
+                found[rendition.source][rendition.size] = rendition
+    return found
+
+
+def attach_renditions(instances, field='image', found=None):
+    ##loads the renditions of every picture in a listing with a single query, or none when
+    ##the caller already fetched them with renditions_for()
+    instances = list(instances)
+    files = [getattr(obj, field) for obj in instances]
+    if found is None:
+        found = renditions_for(f.name for f in files)
+    for f in files:
+        cache = f.instance.__dict__.setdefault('_renditions', {})
+        cache[f.name] = found.get(f.name, {})
+    return instances
+
+
+def get_rendition(field_file, size, format='jpeg'):
+    if not field_file:
+        return None
+    cache = field_file.instance.__dict__.setdefault('_renditions', {})
+    if field_file.name not in cache:
+        cache[field_file.name] = renditions_for([field_file.name])[field_file.name]
+    return cache[field_file.name].get((size, format))
+
+
+def srcset(field_file, size, format='jpeg'):
+    ##"url 400w, url 800w, ..." over the width steps of a size, one entry per distinct width
+    ##(a small original gives the same width for several steps)
+    entries = {}
+    for step in SRCSETS.get(size, (size,)):
+        rendition = get_rendition(field_file, step, format)
+        if rendition is not None:
+            entries.setdefault(rendition.width, rendition.file.url)
+    return ', '.join(f'{url} {width}w' for width, url in sorted(entries.items()))
+
+
+def rendition_url(field_file, size):
+    rendition = get_rendition(field_file, size)
+    if rendition is None:
+        return static(PLACEHOLDER)
+    return rendition.file.url
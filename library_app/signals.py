@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import fragments
+from .models import Album, Image
+
+
+##any write to an album or its pictures retires the cached grids that show them
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Album)
+def album_changed(sender, instance, **kwargs):
+    fragments.invalidate_album(instance)
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def image_changed(sender, instance, **kwargs):
+    if Image.albums.is_cached(instance):
+        user_id = instance.albums.user_id
+    else:
+        user_id = _album_owner(instance.albums_id)
+    fragments.invalidate_album(Album(id=instance.albums_id, user_id=user_id))
+
+
+##albums never change owner, so the lookup can be remembered; this keeps a cascading
+##album delete from querying once per image
+_owners = {}
+
+
+def _album_owner(album_id):
+    if album_id not in _owners:
+        user_id = Album.objects.filter(id=album_id).values_list('user_id', flat=True).first()
+        if user_id is None:
+            return None
+        if len(_owners) >= 4096:
+            _owners.clear()
+        _owners[album_id] = user_id
+    return _owners[album_id]
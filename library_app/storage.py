@@ -0,0 +1,97 @@
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import cloudinary.api
+from cloudinary_storage.storage import MediaCloudinaryStorage
+from django.conf import settings
+from django.core.files.storage import default_storage
+from quartz_app.metrics import bind
+
+from .models import Rendition
+
+
+##cloudinary's admin api deletes or looks up to 100 public ids per call
+CLOUDINARY_BATCH = 100
+
+##names that carry a content hash: originals are stored as images/<sha256>.<ext> (blobs.py) and
+##renditions as <original's sha256>_<size>.<12 hex of their own bytes>.<ext>, so the bytes behind
+##such a name never change and it can be cached forever. the storage may add _<7 chars> to a name
+##that is taken, any other run of digits (IMG_20190612123456.jpg) is not a hash
+HASHED_NAME = re.compile(r'^[0-9a-f]{64}(_[0-9A-Za-z]{7})?(\.\w+)?$|\.[0-9a-f]{12}(_[0-9A-Za-z]{7})?\.\w+$')
+
+
+def hashed_name(name, data):
+    root, ext = os.path.splitext(name)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def immutable(name):
+    return bool(HASHED_NAME.search(os.path.basename(name)))
+
+
+##batch operations over whatever DEFAULT_FILE_STORAGE is. backends with a batch api (cloudinary's
+##admin api, batch_delete/batch_exists on library_app/backends.py) get one request per batch,
+##the others one request per file, STORAGE_CONCURRENCY at a time
+
+def _map(func, items):
+    with ThreadPoolExecutor(max_workers=min(settings.STORAGE_CONCURRENCY, len(items))) as pool:
+        return list(pool.map(bind(func), items))
+
+
+def save_many(files, storage=None):
+    ##[(name, content)] -> the names they were stored under, in the same order
+    storage = storage or default_storage
+    files = list(files)
+    if not files:
+        return []
+    return _map(lambda item: storage.save(*item), files)
+
+
+def delete_many(names, storage=None):
+    ##removes files in as few backend round-trips as the backend allows, missing files are ignored
+    storage = storage or default_storage
+    names = sorted({name for name in names if name})
+    if not names:
+        return
+    if isinstance(storage, MediaCloudinaryStorage):
+        for start in range(0, len(names), CLOUDINARY_BATCH):
+            cloudinary.api.delete_resources(
+                names[start:start + CLOUDINARY_BATCH],
+                invalidate=True,
+                resource_type=storage.RESOURCE_TYPE,
+            )
+    elif hasattr(storage, 'batch_delete'):
+        storage.batch_delete(names)
+    else:
+        _map(storage.delete, names)
+
+
+def exists_many(names, storage=None):
+    ##name -> whether the backend has it
+    storage = storage or default_storage
+    names = sorted({name for name in names if name})
+    if not names:
+        return {}
+    if isinstance(storage, MediaCloudinaryStorage):
+        found = set()
+        for start in range(0, len(names), CLOUDINARY_BATCH):
+            response = cloudinary.api.resources_by_ids(
+                names[start:start + CLOUDINARY_BATCH],
+                resource_type=storage.RESOURCE_TYPE,
+                max_results=CLOUDINARY_BATCH,
+            )
+            found.update(resource['public_id'] for resource in response['resources'])
+        return {name: name in found for name in names}
+    if hasattr(storage, 'batch_exists'):
+        return storage.batch_exists(names)
+    return dict(zip(names, _map(storage.exists, names)))
+
+
+def purge(names):
+    ##deletes originals together with their renditions
+    names = [name for name in names if name]
+    renditions = Rendition.objects.filter(source__in=names)
+    delete_many(names + list(renditions.values_list('file', flat=True)))
+    renditions.delete()
@@ -0,0 +1,150 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from . import blobs, fragments, metadata, usage
+from .jobs import discard, handler, progress
+from .models import Album, Image, Job
+from .renditions import decode, generate_renditions, missing_sizes
+from .storage import purge
+
+
+##images removed per round of delete_album
+DELETE_BATCH = 100
+
+
+@handler('process_upload')
+def process_upload(job, image_id, filename, name=None, path=None):
+    ##name is the spooled file in the media storage, path a local one queued before the spool moved there
+    spooled = _Spooled(name, path)
+    image = Image.objects.select_related('albums').filter(id=image_id).first()
+    if image is None or image.albums.deleting:
+        ##deleted while it was waiting in the queue, or about to be with its album
+        spooled.discard()
+        return
+    try:
+        with spooled.open() as fh:
+            img = None
+            if not image.image:
+                ##saved right away so a retry does not upload the original twice. bytes that are
+                ##already stored (the same photo in another album) are shared, not uploaded again
+                sha256, size = blobs.digest(fh)
+                with transaction.atomic():
+                    blob = blobs.acquire(sha256)
+                    if blob is None:
+                        img = decode(fh)
+                        ##exif is read while the spooled file is at hand, never from storage
+                        values = metadata.extract(fh, img)
+                        fh.seek(0)
+                        blob = blobs.create(fh, sha256, size, filename, dimensions=img.size)
+                    else:
+                        values = metadata.known(blob.name) or {}
+                    image.image.name = blob.name
+                    image.size, image.width, image.height = blob.size, blob.width, blob.height
+                    for field, value in values.items():
+                        setattr(image, field, value)
+                    image.save(update_fields=['image', 'size', 'width', 'height', *values])
+                    usage.add(image.albums_id, 1, image.size)
+            sizes = missing_sizes(image.image.name)
+            if sizes:
+                fh.seek(0)
+                generate_renditions(image.image, sizes, img=img or decode(fh))
+    except Exception:
+        if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            image.status = Image.FAILED
+            image.save(update_fields=['status'])
+            spooled.discard()
+        raise
+    image.status = Image.READY
+    image.save(update_fields=['status'])
+    spooled.discard()
+
+
+@handler('cover_renditions')
+def cover_renditions(job, album_id):
+    album = Album.objects.filter(id=album_id).first()
+    if album is None or not album.album_cover:
+        return
+    sizes = missing_sizes(album.album_cover.name)
+    if sizes:
+        generate_renditions(album.album_cover, sizes)
+        ##rendition rows do not touch the album, its cached grids have to be told
+        fragments.invalidate_album(album)
+
+
+@handler('delete_album')
+def delete_album(job, album_id):
+    ##rows and blob references go in one transaction and the freed files right after it, so an
+    ##interrupted run starts over on what is left; at worst a crash between the two orphans a file
+    album = Album.objects.filter(id=album_id).first()
+    if album is None:
+        return
+    if not job.total:
+        job.total = Image.objects.filter(albums=album_id).count()
+        Job.objects.filter(id=job.id).update(total=job.total)
+
+    while True:
+        batch = list(Image.objects.filter(albums=album_id).order_by('id')[:DELETE_BATCH])
+        if not batch:
+            break
+        with transaction.atomic(), fragments.batched():
+            deleted, names = blobs.remove_images(Image.objects.filter(id__in=[image.id for image in batch]))
+            progress(job, len(deleted))
+        purge(names)
+
+    ##a picture processed since the last batch is released here too, the cascade would delete
+    ##its row without giving back its blob reference or its share of the profile's usage
+    with transaction.atomic(), fragments.batched():
+        if not Album.objects.select_for_update().filter(id=album_id).exists():
+            ##deleted by another run of this job in the meantime
+            return
+        _, names = blobs.remove_images(Image.objects.filter(albums=album_id))
+        names += blobs.release([album.album_cover.name])
+        album.delete()
+    purge(names)
+
+
+@handler('extract_metadata')
+def extract_metadata(job, album_id):
+    ##backfill for pictures stored before metadata was read at upload, queued the first time
+    ##an album is listed by capture date (views.album_listing)
+    album = Album.objects.filter(id=album_id).first()
+    if album is None:
+        return
+    missing = Image.objects.filter(albums=album_id, metadata_at__isnull=True).exclude(image='')
+    if not job.total:
+        job.total = missing.count()
+        Job.objects.filter(id=job.id).update(total=job.total)
+
+    while True:
+        batch = list(missing.order_by('id').only('id', 'image', 'metadata_at')[:metadata.BATCH])
+        if not batch:
+            break
+        done = metadata.backfill(batch)
+        progress(job, len(batch))
+        ##update() sends no post_save, the cached grids are retired here
+        fragments.invalidate_album(album)
+        if not done:
+            break
+
+
+class _Spooled:
+
+    def __init__(self, name, path):
+        self.name, self.path = name, path
+
+    def open(self):
+        if self.name:
+            return default_storage.open(self.name, 'rb')
+        return open(self.path, 'rb')
+
+    def discard(self):
+        if self.name:
+            discard(self.name)
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,57 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from ..renditions import ENCODINGS, PLACEHOLDER, get_rendition, rendition_url, srcset
+
+register = template.Library()
+
+##layout hints for the browser's srcset choice, per requested size
+SIZES = {
+    'tile': '200px',
+    'gallery': '(max-width: 576px) 100vw, (max-width: 992px) 50vw, 33vw',
+    'lightbox': '100vw',
+}
+
+
+##{{ images.image|rendition:'tile' }} -> url of the resized copy, or the processing placeholder
+@register.filter
+def rendition(field_file, size):
+    return rendition_url(field_file, size)
+
+
+##{% picture images.image 'gallery' class='card-img-top' alt='' %} -> <picture> with an avif and
+##webp <source> and a jpeg <img>, each with a srcset over the width steps of the size. the img
+##carries the rendition's width and height so the layout is fixed before it loads, and the
+##picture's blur-up preview (Image.preview) as its background. with defer=True the preview is
+##the src and main.js swaps in the real srcset when the picture nears the viewport
+@register.simple_tag
+def picture(field_file, size, sizes=None, defer=False, **attrs):
+    extra = format_html_join('', ' {}="{}"', ((name.replace('_', '-'), value) for name, value in attrs.items()))
+    fallback = get_rendition(field_file, size)
+    if fallback is None:
+        return format_html('<img src="{}"{}>', static(PLACEHOLDER), extra)
+
+    preview = getattr(field_file.instance, 'preview', '')
+    color = getattr(field_file.instance, 'dominant_color', '')
+    sizes = sizes or SIZES.get(size, '100vw')
+    ##data- attributes until main.js loads them, only when there is something to show meanwhile
+    prefix = 'data-' if defer and preview else ''
+    sources = format_html_join('', '<source type="{}" {}srcset="{}" sizes="{}">', (
+        (ENCODINGS[format][1], prefix, candidates, sizes)
+        for format, candidates in ((format, srcset(field_file, size, format)) for format in ENCODINGS if format != 'jpeg')
+        if candidates
+    ))
+    if prefix:
+        src = format_html('src="{}" data-src="{}" data-srcset="{}"', preview, fallback.file.url, srcset(field_file, size))
+    else:
+        src = format_html('src="{}" srcset="{}"', fallback.file.url, srcset(field_file, size))
+    style = ''
+    if preview or color:
+        style = format_html(' style="background: {} {} center / cover no-repeat"', color or '',
+                            format_html('url({})', preview) if preview else '')
+    return format_html(
+        '<picture>{}<img {} sizes="{}" width="{}" height="{}"{}{}{}></picture>',
+        sources, src, sizes, fallback.width, fallback.height,
+        '' if prefix else format_html(' loading="lazy"'), style, extra,
+    )
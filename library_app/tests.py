@@ -1,3 +1,1174 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+from users_app.models import Profile
+
+from . import backends, blobs, exports, fragments, jobs, metadata, storage, tasks, uploads, usage, views
+from .management.commands import benchmark, import_images
+from .models import Album, Blob, Image, Job, Rendition, UploadSession
+from .pagination import PAGE_SIZE, CursorPage, InvalidCursor
+from .renditions import RENDITION_SIZES, formats, generate_renditions
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def renditions_per_file():
+    return len(RENDITION_SIZES) * len(formats())
+
+
+def make_upload(name='photo.jpg', size=(1200, 900), color='teal', taken=None):
+    buf = BytesIO()
+    exif = PILImage.Exif()
+    if taken:
+        exif[metadata.DATETIME_ORIGINAL] = taken
+        exif[metadata.MAKE] = 'Canon'
+    PILImage.new('RGB', size, color).save(buf, 'JPEG', exif=exif.tobytes())
+    return SimpleUploadedFile(name, buf.getvalue(), content_type='image/jpeg')
+
+
+##keeps uploads on local disk instead of cloudinary and skips the whitenoise manifest
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    MEDIA_ROOT=MEDIA_ROOT,
+    UPLOAD_SPOOL_DIR=MEDIA_ROOT + '/spool',
+    JOB_WORKERS=0,
+)
+class LibraryTestCase(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pass12345')
+        self.client.force_login(self.user)
+        self.album = Album.objects.create(title='Trip', user=self.user)
+        ##ids are reused between tests, old fragments must not leak into the next one
+        fragments.get_cache().clear()
+
+    def upload(self, *files):
+        response = self.client.post(reverse('upload', args=[self.album.id]), {'image_file': list(files)})
+        jobs.run_pending()
+        return response
+
+
+class RenditionTests(LibraryTestCase):
+
+    def test_upload_generates_every_size(self):
+        self.upload(make_upload())
+
+        image = Image.objects.get(albums=self.album)
+        renditions = {r.size: r for r in Rendition.objects.filter(source=image.image.name)}
+        self.assertEqual(set(renditions), set(RENDITION_SIZES))
+        self.assertEqual((renditions['tile'].width, renditions['tile'].height), (200, 200))
+        self.assertEqual(renditions['gallery'].width, 800)
+        ##named after their own bytes, quartz_app.views.serve_media caches them for good
+        self.assertTrue(storage.immutable(image.image.name))
+        self.assertTrue(all(storage.immutable(r.file.name) for r in renditions.values()))
+        self.assertFalse(storage.immutable('images/photo_AbC1234.jpg'))
+        self.assertFalse(storage.immutable('images/IMG_20190612123456.jpg'))
+        self.assertFalse(storage.immutable('images/scan_0123456789abcdef.jpg'))
+        self.assertTrue(storage.immutable(f'images/{"0" * 64}_AbC1234.jpg'))
+
+    def test_modern_formats_when_pillow_supports_them(self):
+        with self.settings(RENDITION_FORMATS=['webp', 'bmp']):
+            self.assertEqual(formats(), ['webp', 'jpeg'])
+            self.upload(make_upload())
+
+        image = Image.objects.get(albums=self.album)
+        stored = set(Rendition.objects.filter(source=image.image.name).values_list('size', 'format'))
+        self.assertEqual(stored, {(size, format) for size in RENDITION_SIZES for format in ('webp', 'jpeg')})
+        webp = Rendition.objects.get(source=image.image.name, size='gallery', format='webp')
+        self.assertTrue(webp.file.name.endswith('.webp'))
+        self.assertEqual(PILImage.open(webp.file.path).format, 'WEBP')
+
+    def test_picture_markup(self):
+        with self.settings(RENDITION_FORMATS=['webp']):
+            self.upload(make_upload(size=(1200, 900)))
+        image = Image.objects.get(albums=self.album)
+        url = {(r.size, r.format): r.file.url for r in Rendition.objects.all()}
+
+        response = self.client.get(reverse('gallery', args=[self.album.id]))
+        ##the 1600 step of a 1200 wide original is left out, it is no wider than the 1200 one
+        self.assertContains(response, '<source type="image/webp" data-srcset="{} 400w, {} 800w, {} 1200w"'.format(
+            url['small', 'webp'], url['gallery', 'webp'], url['large', 'webp']))
+        self.assertContains(response, 'data-src="{}" data-srcset="{} 400w, {} 800w, {} 1200w"'.format(
+            url['gallery', 'jpeg'], url['small', 'jpeg'], url['gallery', 'jpeg'], url['large', 'jpeg']))
+        self.assertContains(response, 'width="800" height="600"')
+        self.assertNotContains(response, 'image/avif')
+
+        response = self.client.get(reverse('pics', args=[self.album.id]))
+        self.assertContains(response, 'srcset="{} 200w, {} 400w" sizes="200px"'.format(
+            url['tile', 'jpeg'], url['tile_2x', 'jpeg']))
+
+    def test_blur_up_preview(self):
+        self.upload(make_upload(size=(1200, 900), color='red'))
+        image = Image.objects.get(albums=self.album)
+
+        self.assertTrue(image.preview.startswith('data:image/jpeg;base64,'))
+        self.assertLess(len(image.preview), 1000)
+        preview = PILImage.open(BytesIO(base64.b64decode(image.preview.split(',', 1)[1])))
+        self.assertEqual(preview.size, (16, 12))
+
+        ##the gallery paints the preview first and leaves the real sources to main.js
+        response = self.client.get(reverse('gallery', args=[self.album.id]))
+        self.assertContains(response, f'<img src="{image.preview}" data-src=')
+        ##the grid loads its tiles right away, over the preview
+        response = self.client.get(reverse('pics', args=[self.album.id]))
+        self.assertContains(response, f'url({image.preview}) center / cover')
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_templates_never_link_the_original(self):
+        self.upload(make_upload())
+        image = Image.objects.get(albums=self.album)
+
+        for name in ('pics', 'gallery'):
+            response = self.client.get(reverse(name, args=[self.album.id]))
+            self.assertNotContains(response, image.image.url)
+            self.assertContains(response, 'renditions/')
+
+    def test_missing_rendition_renders_placeholder(self):
+        Image.objects.create(image=make_upload(), albums=self.album)
+
+        response = self.client.get(reverse('pics', args=[self.album.id]))
+        self.assertContains(response, 'img/processing.svg')
+
+    def test_regenerated_renditions_replace_their_files(self):
+        self.upload(make_upload())
+        image = Image.objects.get(albums=self.album)
+        old = set(Rendition.objects.values_list('file', flat=True))
+
+        generate_renditions(image.image, img=PILImage.new('RGB', (1000, 800), 'olive'))
+        new = set(Rendition.objects.values_list('file', flat=True))
+        self.assertEqual(len(new), len(old))
+        self.assertFalse(old & new)
+        self.assertFalse([name for name in old if default_storage.exists(name)])
+        self.assertTrue(all(default_storage.exists(name) for name in new))
+
+    def test_album_cover_rendition(self):
+        self.client.post(reverse('create'), {'title': 'Covers', 'album_cover': make_upload()})
+        album = Album.objects.get(title='Covers')
+        ##the overview is cached before the job has built the cover renditions
+        self.assertContains(self.client.get(reverse('view')), 'img/processing.svg')
+        self.assertEqual(jobs.run_pending(), 1)
+
+        response = self.client.get(reverse('view'))
+        rendition = Rendition.objects.get(source=album.album_cover.name, size='gallery', format='jpeg')
+        self.assertContains(response, rendition.file.url)
+        self.assertNotContains(response, album.album_cover.url + '"')
+
+
+class JobQueueTests(LibraryTestCase):
+
+    def test_upload_returns_before_processing(self):
+        response = self.client.post(reverse('upload', args=[self.album.id]),
+                                    {'image_file': [make_upload('a.jpg'), make_upload('b.jpg', color='navy')]})
+
+        self.assertContains(response, 'Processing', count=2)
+        self.assertEqual(Image.objects.filter(status=Image.PENDING).count(), 2)
+        self.assertEqual(Rendition.objects.count(), 0)
+
+        self.assertEqual(jobs.run_pending(), 2)
+        self.assertEqual(Image.objects.filter(status=Image.READY).count(), 2)
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 2)
+        self.assertEqual(Rendition.objects.count(), 2 * renditions_per_file())
+
+    def test_gallery_hides_pending_images(self):
+        self.client.post(reverse('upload', args=[self.album.id]), {'image_file': [make_upload()]})
+
+        response = self.client.get(reverse('gallery', args=[self.album.id]))
+        self.assertNotContains(response, 'grid-image-container')
+
+    def test_undecodable_upload_fails_after_retries(self):
+        bogus = SimpleUploadedFile('bogus.jpg', b'not an image', content_type='image/jpeg')
+        self.client.post(reverse('upload', args=[self.album.id]), {'image_file': [bogus]})
+
+        with self.assertLogs('library_app.jobs', 'ERROR'):
+            while jobs.run_pending():
+                pass
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 3)
+        self.assertEqual(Image.objects.get().status, Image.FAILED)
+
+    def test_worker_command_drains_queue(self):
+        self.client.post(reverse('upload', args=[self.album.id]), {'image_file': [make_upload()]})
+
+        call_command('process_jobs', '--once', '--workers', '1', stdout=StringIO())
+        self.assertEqual(Image.objects.get().status, Image.READY)
+
+    def test_spool_is_in_the_media_storage(self):
+        self.client.post(reverse('upload', args=[self.album.id]), {'image_file': [make_upload()]})
+        name = json.loads(Job.objects.get().payload)['name']
+        self.assertTrue(name.startswith(jobs.SPOOL_PREFIX))
+        self.assertTrue(default_storage.exists(name))
+
+        jobs.run_pending()
+        self.assertFalse(default_storage.exists(name))
+
+    def test_files_are_spooled_before_the_album_is_locked(self):
+        ##the spool is remote storage in production, the album's lock is not held across it
+        steps = []
+        save_many, lock_album = jobs.save_many, uploads.lock_album
+
+        def saving(files):
+            files = list(files)
+            steps.append(('save', len(files)))
+            return save_many(files)
+
+        def locking(album_id):
+            steps.append('lock')
+            return lock_album(album_id)
+
+        with mock.patch.object(jobs, 'save_many', side_effect=saving), \
+                mock.patch.object(uploads, 'lock_album', side_effect=locking):
+            self.client.post(reverse('upload', args=[self.album.id]),
+                             {'image_file': [make_upload('a.jpg'), make_upload('b.jpg', color='navy')]})
+        ##both files in one parallel batch
+        self.assertEqual(steps, [('save', 2), 'lock'])
+        self.assertEqual(Image.objects.count(), 2)
+
+    def test_worker_recovers_jobs_a_web_process_lost(self):
+        ##the pool's submit is lost (on_commit never fires in a TestCase, like a recycled worker)
+        ##and a second job was left running by a process that died
+        with self.settings(JOB_WORKERS=2):
+            self.client.post(reverse('upload', args=[self.album.id]),
+                             {'image_file': [make_upload('a.jpg'), make_upload('b.jpg', color='navy')]})
+        abandoned = Job.objects.order_by('id').last()
+        Job.objects.filter(id=abandoned.id).update(
+            status=Job.RUNNING, attempts=1, started_at=timezone.now() - timedelta(hours=1))
+
+        out = StringIO()
+        call_command('process_jobs', '--once', '--workers', '1', stdout=out)
+        self.assertIn('Requeued 1 stale jobs', out.getvalue())
+        self.assertEqual(Image.objects.filter(status=Image.READY).count(), 2)
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 2)
+
+
+class PaginationTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Image.objects.bulk_create(
+            Image(image=f'images/{i}.jpg', title=str(i % 3), albums=self.album) for i in range(PAGE_SIZE + 5)
+        )
+
+    def test_cursor_walks_every_row_once(self):
+        seen = []
+        cursor = None
+        while True:
+            page = CursorPage(Image.objects.all(), cursor, size=7, ordering=('title', '-id'))
+            seen += [image.id for image in page]
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        expected = list(Image.objects.order_by('title', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor_is_rejected(self):
+        with self.assertRaises(InvalidCursor):
+            CursorPage(Image.objects.all(), 'not-a-cursor')
+
+    def test_album_renders_first_page_and_links_the_next(self):
+        response = self.client.get(reverse('pics', args=[self.album.id]))
+
+        self.assertEqual(len(response.context['images']), PAGE_SIZE)
+        self.assertContains(response, 'class="card mb-5', count=PAGE_SIZE)
+        self.assertContains(response, 'data-next')
+
+        page = self.client.get(response.context['next_url']).json()
+        self.assertEqual(page['count'], 5)
+        self.assertIsNone(page['next'])
+        self.assertEqual(page['html'].count('class="card mb-5'), 5)
+
+    def test_page_endpoint_validates_input(self):
+        url = reverse('pics_page', args=[self.album.id])
+        self.assertEqual(self.client.get(url, {'cursor': 'bogus'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'layout': 'bogus'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'layout': 'gallery'}).json()['count'], PAGE_SIZE)
+
+
+class ExplainQueriesTests(LibraryTestCase):
+
+    def test_listing_plans_use_the_indexes(self):
+        Image.objects.bulk_create(Image(image=f'images/{i}.jpg', albums=self.album) for i in range(3))
+        out = StringIO()
+
+        call_command('explain_queries', '--strict', stdout=out, stderr=StringIO())
+        for name in ('viewAlbums', 'viewPicturesByAlbum', 'viewGallery'):
+            self.assertIn(name, out.getvalue())
+        self.assertIn('image_album_created_idx', out.getvalue())
+        self.assertIn('album_user_created_idx', out.getvalue())
+
+
+class FragmentCacheTests(LibraryTestCase):
+
+    def test_repeat_visit_skips_the_listing_queries(self):
+        Image.objects.bulk_create(Image(image=f'images/{i}.jpg', albums=self.album) for i in range(3))
+        url = reverse('pics', args=[self.album.id])
+        first = self.client.get(url)
+
+        ##session, user and album only
+        with self.assertNumQueries(3):
+            second = self.client.get(url)
+        self.assertEqual(first.context['grid'], second.context['grid'])
+
+    def test_writes_invalidate_the_grids(self):
+        self.upload(make_upload())
+        image = Image.objects.get()
+        self.assertContains(self.client.get(reverse('pics', args=[self.album.id])), 'x-delete', count=1)
+        self.assertContains(self.client.get(reverse('gallery', args=[self.album.id])), 'grid-image-container', count=1)
+
+        self.client.post(reverse('delete_images', args=[image.id]))
+        self.assertNotContains(self.client.get(reverse('pics', args=[self.album.id])), 'x-delete')
+        self.assertNotContains(self.client.get(reverse('gallery', args=[self.album.id])), 'grid-image-container')
+
+    def test_album_overview_follows_album_changes(self):
+        self.assertContains(self.client.get(reverse('view')), 'Trip')
+
+        self.album.title = 'Holiday'
+        self.album.save()
+        response = self.client.get(reverse('view'))
+        self.assertContains(response, 'Holiday')
+        self.assertNotContains(response, 'Trip')
+
+    def test_a_bump_in_another_process_reaches_this_one(self):
+        ##two processes, each with its own locmem cache of rendered html
+        here, there = LocMemCache('here', {}), LocMemCache('there', {})
+        url = reverse('pics', args=[self.album.id])
+        Image.objects.create(image='images/a.jpg', albums=self.album)
+        with mock.patch.object(fragments, 'get_cache', return_value=here):
+            before = fragments.key('album', self.album.id, 'grid')
+            self.assertContains(self.client.get(url), 'x-delete', count=1)
+
+        with mock.patch.object(fragments, 'get_cache', return_value=there):
+            Image.objects.create(image='images/b.jpg', albums=self.album)
+
+        with mock.patch.object(fragments, 'get_cache', return_value=here):
+            self.assertNotEqual(fragments.key('album', self.album.id, 'grid'), before)
+            self.assertContains(self.client.get(url), 'x-delete', count=2)
+
+    def test_grids_carry_no_csrf_token(self):
+        Image.objects.create(image='images/a.jpg', albums=self.album)
+        self.client.get(reverse('pics', args=[self.album.id]))
+        html = fragments.cached(fragments.key('album', self.album.id, 'grid'), lambda: None)
+        self.assertNotIn('csrfmiddlewaretoken', html)
+        self.assertIn('form="delete-image-form"', html)
+
+
+class AlbumLoaderTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.upload(*[make_upload(f'{i}.jpg', size=(300, 300), color=(i * 40, 0, 0)) for i in range(3)])
+
+    def test_album_pages_in_fixed_queries(self):
+        ##session, user, album, images and renditions, the navbar avatar is on the session
+        with self.assertNumQueries(5):
+            self.client.get(reverse('pics', args=[self.album.id]))
+        with self.assertNumQueries(5):
+            self.client.get(reverse('gallery', args=[self.album.id]))
+        fragments.get_cache().clear()
+        with self.assertNumQueries(5):
+            self.client.get(reverse('pics_page', args=[self.album.id]), {'layout': 'grid'})
+        with self.assertNumQueries(3):
+            self.client.get(reverse('upload', args=[self.album.id]))
+        with self.assertNumQueries(3):
+            self.client.get(reverse('export_album', args=[self.album.id]))
+
+    def test_deleting_an_image_loads_it_with_its_album(self):
+        image = Image.objects.first()
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(reverse('delete_images', args=[image.id]))
+        selects = [query['sql'] for query in captured if query['sql'].startswith('SELECT')]
+        ##the album is only asked for the fragment_version the delete bumped
+        albums = [sql for sql in selects if 'FROM "library_app_album"' in sql]
+        self.assertEqual(len(albums), 1)
+        self.assertNotIn('"title"', albums[0])
+        ##the picture with its album, its row locked for the delete, then the re-rendered grid
+        self.assertEqual(sum('FROM "library_app_image"' in sql for sql in selects), 3)
+        self.assertEqual(response.context['albums'], self.album)
+
+    def test_new_album_is_not_read_back(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(reverse('create'), {'title': 'New'})
+        self.assertFalse([query for query in captured if query['sql'].startswith('SELECT "library_app_album"')])
+        self.assertEqual(response.context['albums'].title, 'New')
+
+    def test_albums_and_images_are_private(self):
+        image = Image.objects.first()
+        self.client.force_login(User.objects.create_user('bob', 'bob@example.com', 'pass12345'))
+
+        for name in ('pics', 'gallery', 'pics_page', 'upload'):
+            self.assertEqual(self.client.get(reverse(name, args=[self.album.id])).status_code, 404)
+        self.assertEqual(self.client.post(reverse('delete_images', args=[image.id])).status_code, 404)
+        self.assertTrue(Image.objects.filter(id=image.id).exists())
+
+
+class LRUFileBasedCacheTests(TestCase):
+
+    def test_culls_least_recently_read(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, True)
+        cache = fragments.LRUFileBasedCache(location, {'OPTIONS': {'MAX_ENTRIES': 3, 'CULL_FREQUENCY': 3}})
+
+        for i, name in enumerate(['a', 'b', 'c']):
+            cache.set(name, name)
+            os.utime(cache._key_to_file(name), (1000 + i, 1000 + i))
+        cache.get('a')
+        cache.set('d', 'd')
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get(k) for k in 'acd'], ['a', 'c', 'd'])
+
+
+class AlbumDeletionTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.upload(*[make_upload(f'{i}.jpg', size=(300, 300), color=(i * 50, 0, 0)) for i in range(5)])
+        self.files = list(Image.objects.values_list('image', flat=True))
+        self.files += list(Rendition.objects.values_list('file', flat=True))
+
+    def stored(self):
+        return [name for name in self.files if os.path.exists(os.path.join(MEDIA_ROOT, name))]
+
+    def test_delete_runs_in_the_background(self):
+        response = self.client.post(reverse('delete_album', args=[self.album.id]))
+
+        self.assertRedirects(response, reverse('view'))
+        self.assertTrue(Album.objects.get().deleting)
+        self.assertContains(self.client.get(reverse('view')), 'Deleting')
+        self.assertEqual(len(self.stored()), 5 * (1 + renditions_per_file()))
+
+        jobs.run_pending()
+        self.assertFalse(Album.objects.exists())
+        self.assertFalse(Image.objects.exists())
+        self.assertFalse(Rendition.objects.exists())
+        self.assertEqual(self.stored(), [])
+        job = Job.objects.get(kind='delete_album')
+        self.assertEqual((job.progress, job.total, job.status), (5, 5, Job.DONE))
+
+    def test_racing_requests_queue_one_delete(self):
+        self.assertEqual(self.client.get(reverse('delete_album', args=[self.album.id])).status_code, 405)
+        self.assertFalse(Album.objects.get().deleting)
+
+        ##both requests read the album before either had marked it
+        loaded = Album.objects.get()
+        with mock.patch.object(views, 'user_album', return_value=loaded):
+            self.client.post(reverse('delete_album', args=[self.album.id]))
+            self.client.post(reverse('delete_album', args=[self.album.id]))
+        self.assertEqual(Job.objects.filter(kind='delete_album').count(), 1)
+
+    def test_a_long_delete_is_not_handed_out_again(self):
+        self.client.post(reverse('delete_album', args=[self.album.id]))
+        requeued = []
+
+        def slow_purge(names):
+            job = Job.objects.get(kind='delete_album')
+            if job.progress == 2:
+                ##the first batch took longer than --stale-after
+                Job.objects.filter(id=job.id).update(started_at=timezone.now() - timedelta(hours=1))
+            else:
+                requeued.append(jobs.requeue_stale(timedelta(minutes=30)))
+            return storage.purge(names)
+
+        with mock.patch.object(tasks, 'DELETE_BATCH', 2), mock.patch.object(tasks, 'purge', slow_purge):
+            jobs.run_pending()
+        self.assertEqual(requeued[0], 0)
+        self.assertEqual(Job.objects.get(kind='delete_album').status, Job.DONE)
+
+    def test_interrupted_delete_resumes(self):
+        self.client.post(reverse('delete_album', args=[self.album.id]))
+
+        release = blobs.release
+        calls = []
+
+        def flaky_release(names):
+            calls.append(names)
+            if len(calls) > 1:
+                raise RuntimeError('boom')
+            return release(names)
+
+        with mock.patch.object(tasks, 'DELETE_BATCH', 2), \
+                mock.patch.object(blobs, 'release', flaky_release), \
+                self.assertLogs('library_app.jobs', 'ERROR'):
+            jobs.run_pending()
+        self.assertEqual(Image.objects.count(), 3)
+        self.assertEqual(Job.objects.get(kind='delete_album').progress, 2)
+
+        jobs.run_pending()
+        self.assertFalse(Album.objects.exists())
+        self.assertEqual(Job.objects.get(kind='delete_album').progress, 5)
+
+    def test_uploads_to_an_album_being_deleted_are_refused(self):
+        self.client.post(reverse('upload_start', args=[self.album.id]), {'filename': 'late.jpg', 'size': 10})
+        session = UploadSession.objects.get()
+        with open(session.path, 'wb') as fh:
+            fh.write(b'0123456789')
+        UploadSession.objects.update(received=10)
+        self.client.post(reverse('delete_album', args=[self.album.id]))
+
+        response = self.client.post(reverse('upload', args=[self.album.id]), {'image_file': [make_upload()]})
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post(reverse('upload_start', args=[self.album.id]), {'filename': 'a.jpg', 'size': 10})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.post(reverse('upload_finish', args=[session.id])).status_code, 409)
+        self.assertEqual(Image.objects.count(), 5)
+
+    def test_pictures_queued_before_the_delete_are_not_stored(self):
+        self.client.post(reverse('upload', args=[self.album.id]), {'image_file': [make_upload('late.jpg', color='navy')]})
+        spooled = json.loads(Job.objects.get(kind='process_upload', status=Job.QUEUED).payload)['name']
+        self.client.post(reverse('delete_album', args=[self.album.id]))
+
+        jobs.run_pending()
+        self.assertFalse(Album.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(spooled))
+        self.assertEqual(self.stored(), [])
+
+    def test_a_picture_stored_after_the_last_batch_is_released(self):
+        ##a process_upload that was past its check when the delete was requested commits
+        ##between the job's last batch and the deletion of the album
+        other = Album.objects.create(title='Other', user=self.user)
+        self.album, album = other, self.album
+        self.upload(make_upload('late.jpg', color='navy'))
+        self.album = album
+        late = Image.objects.get(albums=other)
+        self.client.post(reverse('delete_album', args=[album.id]))
+
+        batched = fragments.batched
+        calls = []
+
+        def arrive_late():
+            calls.append(None)
+            if len(calls) == 2:
+                Image.objects.filter(id=late.id).update(albums=album)
+                usage.add(other.id, -1, -late.size)
+                usage.add(album.id, 1, late.size)
+            return batched()
+
+        with mock.patch.object(tasks.fragments, 'batched', arrive_late):
+            jobs.run_pending()
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(Image.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(late.image.name))
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual((profile.image_count, profile.bytes_used), (0, 0))
+
+    def test_only_the_owner_can_delete(self):
+        other = User.objects.create_user('bob', 'bob@example.com', 'pass12345')
+        self.client.force_login(other)
+
+        self.assertEqual(self.client.post(reverse('delete_album', args=[self.album.id])).status_code, 404)
+        self.assertFalse(Job.objects.filter(kind='delete_album').exists())
+
+
+class DeleteManyTests(TestCase):
+
+    def test_cloudinary_deletes_in_batches(self):
+        names = [f'images/{i}' for i in range(250)]
+        with mock.patch('cloudinary.api.delete_resources') as delete_resources:
+            storage.delete_many(names, storage.MediaCloudinaryStorage())
+        self.assertEqual([len(call[0][0]) for call in delete_resources.call_args_list], [100, 100, 50])
+
+    def test_cloudinary_lookups_in_batches(self):
+        names = [f'images/{i}' for i in range(150)]
+        responses = [{'resources': [{'public_id': 'images/1'}]}, {'resources': []}]
+        with mock.patch('cloudinary.api.resources_by_ids', side_effect=responses) as resources_by_ids:
+            found = storage.exists_many(names, storage.MediaCloudinaryStorage())
+        self.assertEqual([len(call[0][0]) for call in resources_by_ids.call_args_list], [100, 50])
+        self.assertEqual([name for name, exists in found.items() if exists], ['images/1'])
+
+
+@override_settings(UPLOAD_CHUNK_SIZE=500)
+class ChunkedUploadTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data = make_upload(size=(300, 300)).read()
+
+    def start(self, size=None):
+        response = self.client.post(reverse('upload_start', args=[self.album.id]), {
+            'filename': 'big.jpg',
+            'size': len(self.data) if size is None else size,
+        })
+        return response, response.json()
+
+    def put(self, url, first, last):
+        return self.client.put(
+            url, self.data[first:last + 1], content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {first}-{last}/{len(self.data)}',
+        )
+
+    def put_all(self, url):
+        for first in range(0, len(self.data), 500):
+            self.put(url, first, min(first + 500, len(self.data)) - 1)
+
+    def test_chunks_are_assembled_and_processed(self):
+        response, session = self.start()
+        self.assertEqual(response.status_code, 201)
+        for first in range(0, len(self.data), 500):
+            last = min(first + 500, len(self.data)) - 1
+            self.assertEqual(self.put(session['url'], first, last).json()['received'], last + 1)
+
+        response = self.client.post(session['finish'])
+        image = Image.objects.get(id=response.json()['image'])
+        self.assertEqual(image.status, Image.PENDING)
+        self.assertFalse(UploadSession.objects.exists())
+
+        jobs.run_pending()
+        image.refresh_from_db()
+        self.assertEqual(image.status, Image.READY)
+        with image.image.open('rb') as fh:
+            self.assertEqual(fh.read(), self.data)
+
+    def test_finish_spools_before_the_album_is_locked(self):
+        _, session = self.start()
+        self.put_all(session['url'])
+        steps = []
+        save_many, lock_album = jobs.save_many, uploads.lock_album
+
+        def saving(files):
+            files = list(files)
+            steps.append(('save', len(files)))
+            return save_many(files)
+
+        def locking(album_id):
+            steps.append('lock')
+            return lock_album(album_id)
+
+        with mock.patch.object(jobs, 'save_many', side_effect=saving), \
+                mock.patch.object(uploads, 'lock_album', side_effect=locking):
+            self.assertEqual(self.client.post(session['finish']).status_code, 200)
+        self.assertEqual(steps, [('save', 1), 'lock'])
+
+        ##a finish that is refused leaves no spooled file behind
+        _, session = self.start()
+        self.put_all(session['url'])
+        Album.objects.update(deleting=True)
+        self.assertEqual(self.client.post(session['finish']).status_code, 409)
+        spooled = [name for name in default_storage.listdir(jobs.SPOOL_PREFIX)[1] if not name.endswith('.part')]
+        self.assertEqual(spooled, [os.path.basename(json.loads(Job.objects.get().payload)['name'])])
+
+    def test_resume_after_a_lost_chunk(self):
+        _, session = self.start()
+        self.put(session['url'], 0, 499)
+
+        response = self.put(session['url'], 1000, 1499)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get(session['url']).json()['received'], 500)
+        ##a repeated chunk is refused rather than appended twice
+        self.assertEqual(self.put(session['url'], 0, 499).status_code, 409)
+
+    def test_limits(self):
+        self.assertEqual(self.start(size=10 ** 12)[0].status_code, 413)
+        _, session = self.start()
+        self.assertEqual(self.put(session['url'], 0, 999).status_code, 413)
+        self.assertEqual(self.client.post(session['finish']).status_code, 409)
+        self.assertFalse(Image.objects.exists())
+
+    def test_sessions_are_private(self):
+        _, session = self.start()
+        other = User.objects.create_user('bob', 'bob@example.com', 'pass12345')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(session['url']).status_code, 404)
+        self.assertEqual(self.client.post(session['finish']).status_code, 404)
+
+    def test_abandoned_uploads_expire(self):
+        _, session = self.start()
+        upload = UploadSession.objects.get()
+        UploadSession.objects.update(updated_at=upload.updated_at - timedelta(days=2))
+
+        self.assertEqual(uploads.expire(timedelta(hours=24)), 1)
+        self.assertFalse(os.path.exists(upload.path))
+
+
+class BlobTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = Album.objects.create(title='Copy', user=User.objects.create_user('bob', 'b@example.com', 'x'))
+
+    def upload_to(self, album, *files):
+        self.client.force_login(album.user)
+        self.client.post(reverse('upload', args=[album.id]), {'image_file': list(files)})
+        jobs.run_pending()
+
+    def stored(self, name):
+        return os.path.exists(os.path.join(MEDIA_ROOT, name))
+
+    def test_same_bytes_are_stored_once(self):
+        with mock.patch('library_app.tasks.generate_renditions', wraps=tasks.generate_renditions) as generate, \
+                mock.patch.object(blobs, 'create', wraps=blobs.create) as create:
+            self.upload_to(self.album, make_upload('a.jpg'))
+            self.upload_to(self.other, make_upload('copy.jpg'))
+        self.assertEqual(create.call_count, 1)
+        self.assertEqual(generate.call_count, 1)
+
+        first, second = Image.objects.order_by('id')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(second.status, Image.READY)
+        self.assertEqual(Blob.objects.get().refcount, 2)
+        self.assertEqual(Rendition.objects.count(), renditions_per_file())
+
+    def test_file_is_deleted_with_its_last_reference(self):
+        self.upload_to(self.album, make_upload('a.jpg'))
+        self.upload_to(self.other, make_upload('copy.jpg'))
+        first, second = Image.objects.order_by('id')
+
+        self.client.force_login(self.user)
+        self.client.get(reverse('delete_images', args=[first.id]))
+        self.assertTrue(self.stored(first.image.name))
+        self.assertEqual(Blob.objects.get().refcount, 1)
+        self.assertEqual(Rendition.objects.count(), renditions_per_file())
+
+        self.client.force_login(self.other.user)
+        self.client.get(reverse('delete_images', args=[second.id]))
+        self.assertFalse(self.stored(first.image.name))
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(Rendition.objects.exists())
+
+    def test_album_cover_shares_an_uploaded_image(self):
+        self.upload_to(self.album, make_upload('a.jpg'))
+        self.client.post(reverse('create'), {'title': 'Covers', 'album_cover': make_upload('cover.jpg')})
+
+        cover = Album.objects.get(title='Covers').album_cover
+        self.assertEqual(cover.name, Image.objects.get().image.name)
+        self.assertEqual(Blob.objects.get().refcount, 2)
+
+    def test_racing_deletes_release_a_picture_once(self):
+        self.upload_to(self.album, make_upload('a.jpg'))
+        self.upload_to(self.other, make_upload('copy.jpg'), make_upload('again.jpg'))
+        first = Image.objects.filter(albums=self.album).get()
+
+        ##the second delete of a double submit waits on the row lock and finds it gone
+        with transaction.atomic():
+            deleted, names = blobs.remove_images(Image.objects.filter(id=first.id))
+        self.assertEqual((len(deleted), names), (1, []))
+        with transaction.atomic():
+            self.assertEqual(blobs.remove_images(Image.objects.filter(id=first.id)), ([], []))
+        self.assertEqual(Blob.objects.get().refcount, 2)
+        self.assertTrue(self.stored(first.image.name))
+
+    def test_files_from_before_blobs_are_released(self):
+        self.assertEqual(blobs.release(['images/legacy.jpg', '']), ['images/legacy.jpg'])
+
+
+class BenchmarkTests(LibraryTestCase):
+
+    def test_writes_and_compares_a_baseline(self):
+        path = os.path.join(MEDIA_ROOT, 'baseline.json')
+        options = {'users': 1, 'albums': 2, 'images': 5, 'iterations': 2, 'use_current_db': True, 'stdout': StringIO()}
+        call_command('benchmark', output=path, **options)
+
+        with open(path) as fh:
+            views = json.load(fh)['views']
+        self.assertEqual(set(views), {'viewAlbums', 'viewPicturesByAlbum', 'viewGallery', 'addImages',
+                                      'addImages (jobs)', 'login', 'delete_album', 'delete_album (jobs)'})
+        self.assertGreater(views['viewPicturesByAlbum']['bytes'], 0)
+        self.assertGreater(views['viewPicturesByAlbum']['queries'], 0)
+
+        views['viewGallery']['queries'] = 0
+        with open(path, 'w') as fh:
+            json.dump({'views': views}, fh)
+        User.objects.filter(username__startswith='bench').delete()
+        with self.assertRaisesMessage(CommandError, 'regressions'):
+            call_command('benchmark', compare=path, stderr=StringIO(), **options)
+
+
+    def test_single_runs_are_compared_by_queries_only(self):
+        path = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path), True)
+        row = {'p50_ms': 100.0, 'queries': 10, 'samples': 1}
+        with open(path, 'w') as fh:
+            json.dump({'views': {'delete_album (jobs)': row}}, fh)
+        command = benchmark.Command(stdout=StringIO(), stderr=StringIO())
+
+        command.compare({'views': {'delete_album (jobs)': dict(row, p50_ms=200.0)}}, path, 1.25)
+        with self.assertRaisesMessage(CommandError, '1 regressions'):
+            command.compare({'views': {'delete_album (jobs)': dict(row, queries=11)}}, path, 1.25)
+        with self.assertRaisesMessage(CommandError, '1 regressions'):
+            command.compare({'views': {'delete_album (jobs)': dict(row, p50_ms=200.0, samples=30)}}, path, 1.25)
+
+
+class AlbumOverviewTests(LibraryTestCase):
+
+    def test_counts_and_previews_in_constant_queries(self):
+        self.upload(*[make_upload(f'{i}.jpg', size=(300, 300), color=(i * 40, 0, 0)) for i in range(4)])
+        for i in range(10):
+            Album.objects.create(title=f'Empty {i}', user=self.user)
+
+        ##session, user, profile (the fragment version of the list), albums, renditions
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('view'))
+        albums = {album.id: album for album in views.attach_previews(views.album_overview(self.user))}
+
+        trip = albums[self.album.id]
+        self.assertEqual(trip.image_count, 4)
+        self.assertEqual(trip.latest_upload, Image.objects.latest('created_at').created_at)
+        newest = Image.objects.order_by('-created_at', '-id')[:views.PREVIEW_COUNT]
+        self.assertEqual([r.source for r in trip.previews], [image.image.name for image in newest])
+        self.assertContains(response, '4 photos')
+        self.assertContains(response, 'class="album-preview"', count=views.PREVIEW_COUNT)
+        self.assertEqual(albums[self.album.id + 1].image_count, 0)
+        self.assertContains(response, '0 photos', count=10)
+
+
+class UsageCounterTests(LibraryTestCase):
+
+    def counters(self):
+        album = Album.objects.get(id=self.album.id)
+        profile = Profile.objects.get(user=self.user)
+        return (album.image_count, album.bytes_used), (profile.image_count, profile.bytes_used)
+
+    def test_upload_and_delete_keep_counters_in_step(self):
+        first, second = make_upload('a.jpg'), make_upload('b.jpg', color='navy')
+        self.upload(first, second)
+        images = list(Image.objects.order_by('id'))
+        total = sum(image.size for image in images)
+
+        self.assertEqual(images[0].size, first.size)
+        self.assertEqual((images[0].width, images[0].height), (1200, 900))
+        self.assertEqual(self.counters(), ((2, total), (2, total)))
+
+        self.client.get(reverse('delete_images', args=[images[0].id]))
+        self.assertEqual(self.counters(), ((1, images[1].size), (1, images[1].size)))
+
+        self.client.post(reverse('delete_album', args=[self.album.id]))
+        jobs.run_pending()
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual((profile.image_count, profile.bytes_used), (0, 0))
+
+    def test_duplicate_upload_copies_size_from_blob(self):
+        self.upload(make_upload('a.jpg'))
+        self.upload(make_upload('copy.jpg'))
+        first, second = Image.objects.order_by('id')
+        self.assertEqual((second.size, second.width, second.height), (first.size, first.width, first.height))
+        self.assertEqual(self.counters()[0], (2, 2 * first.size))
+
+    def test_saving_a_stale_copy_keeps_counters(self):
+        profile = self.user.profile
+        album = Album.objects.get(id=self.album.id)
+        self.upload(make_upload())
+
+        profile.save()
+        album.title = 'Renamed'
+        album.save()
+        self.assertEqual(self.counters()[0][0], 1)
+        self.assertEqual(self.counters()[1][0], 1)
+
+    def test_reconcile_rebuilds_counters(self):
+        self.upload(make_upload())
+        size = Image.objects.get().size
+        Image.objects.update(size=0)
+        Album.objects.update(image_count=7, bytes_used=1)
+        Profile.objects.update(image_count=0)
+
+        out = StringIO()
+        call_command('reconcile_usage', '--dry-run', stdout=out)
+        self.assertIn('1 albums have counters that are off', out.getvalue())
+
+        call_command('reconcile_usage', stdout=StringIO())
+        self.assertEqual(Image.objects.get().size, size)
+        self.assertEqual(self.counters(), ((1, size), (1, size)))
+
+
+class ImportImagesTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source, True)
+        for i, color in enumerate(['red', 'green', 'blue']):
+            with open(os.path.join(self.source, f'{i}.jpg'), 'wb') as fh:
+                fh.write(make_upload(size=(300, 200), color=color).read())
+        with open(os.path.join(self.source, 'copy.jpg'), 'wb') as fh:
+            fh.write(make_upload(size=(300, 200), color='red').read())
+        with open(os.path.join(self.source, 'broken.jpg'), 'wb') as fh:
+            fh.write(b'not an image')
+        with open(os.path.join(self.source, 'notes.txt'), 'w') as fh:
+            fh.write('skipped')
+
+    def run_import(self, path, *args):
+        out = StringIO()
+        call_command('import_images', 'alice', str(self.album.id), path, '--processes', '0',
+                     '--batch', '2', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_imports_a_directory(self):
+        out = self.run_import(self.source)
+
+        self.assertIn('Imported 4 pictures into Trip (1 already stored, 1 failed', out)
+        images = Image.objects.filter(albums=self.album)
+        self.assertEqual(images.count(), 4)
+        self.assertEqual(Blob.objects.count(), 3)
+        self.assertEqual(sorted(Blob.objects.values_list('refcount', flat=True)), [1, 1, 2])
+        self.assertEqual(Rendition.objects.count(), 3 * renditions_per_file())
+        self.assertEqual((images.first().width, images.first().height), (300, 200))
+        album = Album.objects.get(id=self.album.id)
+        self.assertEqual((album.image_count, album.bytes_used), (4, sum(i.size for i in images)))
+
+    def test_imports_archives(self):
+        zipped = shutil.make_archive(self.source + '_library', 'zip', self.source)
+        tarred = shutil.make_archive(self.source + '_library', 'gztar', self.source)
+        self.addCleanup(os.remove, zipped)
+        self.addCleanup(os.remove, tarred)
+
+        self.run_import(zipped)
+        self.assertEqual(Image.objects.count(), 4)
+        ##the same pictures again only take references
+        self.run_import(tarred)
+        self.assertEqual(Image.objects.count(), 8)
+        self.assertEqual(Blob.objects.count(), 3)
+        self.assertEqual(sorted(Blob.objects.values_list('refcount', flat=True)), [2, 2, 4])
+
+    def test_process_pool(self):
+        self.run_import(self.source, '--processes', '2')
+        self.assertEqual(Image.objects.count(), 4)
+
+    def test_stops_when_the_album_is_being_deleted(self):
+        upload, lock_album = import_images.Command.upload, uploads.lock_album
+        stored, locks = [], []
+
+        def uploading(command, result, data):
+            stored.append(upload(command, result, data))
+            return stored[-1]
+
+        def locking(album_id):
+            ##before and after the upload of each batch, the album is deleted while the second one uploads
+            locks.append(album_id)
+            if len(locks) == 4:
+                Album.objects.update(deleting=True)
+            return lock_album(album_id)
+
+        with mock.patch.object(import_images.Command, 'upload', uploading), \
+                mock.patch.object(uploads, 'lock_album', locking), \
+                self.assertRaisesMessage(CommandError, 'Trip is being deleted'):
+            self.run_import(self.source)
+        self.assertEqual(Image.objects.count(), 2)
+        self.assertEqual(Blob.objects.count(), 2)
+        original, renditions = stored[-1]
+        self.assertFalse([name for name in [original, *renditions.values()] if default_storage.exists(name)])
+
+        ##an album already marked is refused before anything is uploaded
+        Album.objects.update(deleting=True)
+        with mock.patch.object(import_images.Command, 'upload', uploading), \
+                self.assertRaisesMessage(CommandError, 'Trip is being deleted'):
+            self.run_import(self.source)
+        self.assertEqual(len(stored), 3)
+
+    def test_unknown_album(self):
+        with self.assertRaisesMessage(CommandError, 'pass --create-album'):
+            call_command('import_images', 'alice', 'Holidays', self.source)
+        self.run_import(self.source, '--create-album')
+
+
+class MetadataTests(LibraryTestCase):
+
+    def test_extracted_at_upload(self):
+        self.upload(make_upload(size=(300, 200), color='red', taken='2019:06:14 10:30:00'))
+
+        image = Image.objects.get(albums=self.album)
+        self.assertEqual(image.captured_at.strftime('%Y-%m-%d %H:%M'), '2019-06-14 10:30')
+        self.assertEqual(image.camera, 'Canon')
+        self.assertEqual(image.dominant_color[:3], '#fe')
+        self.assertIsNotNone(image.metadata_at)
+
+    def test_shared_bytes_copy_the_metadata(self):
+        self.upload(make_upload(color='red', taken='2019:06:14 10:30:00'))
+        other = Album.objects.create(title='Copy', user=self.user)
+        self.client.post(reverse('upload', args=[other.id]),
+                         {'image_file': [make_upload(color='red', taken='2019:06:14 10:30:00')]})
+        with mock.patch.object(metadata, 'extract') as extract:
+            jobs.run_pending()
+
+        extract.assert_not_called()
+        copy = Image.objects.get(albums=other)
+        self.assertEqual(copy.captured_at, Image.objects.get(albums=self.album).captured_at)
+
+    def test_sorts_and_filters_by_capture_date(self):
+        self.upload(
+            make_upload('a.jpg', size=(300, 200), color='red', taken='2019:06:20 09:00:00'),
+            make_upload('b.jpg', size=(300, 200), color='green', taken='2018:01:01 09:00:00'),
+            make_upload('c.jpg', size=(300, 200), color='blue'),
+        )
+        by_name = {image.captured_at.year if image.captured_at else None: image.id
+                   for image in Image.objects.filter(albums=self.album)}
+
+        page = views.album_page(self.album, options=views.listing_options({'sort': 'taken'}))
+        self.assertEqual([image.id for image in page['images']], [by_name[2018], by_name[2019]])
+        june = views.listing_options({'sort': 'taken', 'from': '2019-06-01', 'to': '2019-06-30'})
+        page = views.album_page(self.album, options=june)
+        self.assertEqual([image.id for image in page['images']], [by_name[2019]])
+        self.assertEqual(views.listing_options({'sort': 'oldest', 'from': '2019-13-01'}), {'sort': 'uploaded'})
+
+        response = self.client.get(reverse('pics', args=[self.album.id]), {'sort': 'taken'})
+        self.assertContains(response, 'listing-sort active mr-4')
+        self.assertEqual(response.context['indexing'], 0)
+
+    def test_backfill_is_queued_for_older_pictures(self):
+        self.upload(make_upload(size=(300, 200), color='red', taken='2019:06:20 09:00:00'))
+        Image.objects.update(captured_at=None, camera='', metadata_at=None)
+
+        ##the default listing does not need the columns
+        self.client.get(reverse('pics', args=[self.album.id]))
+        self.assertFalse(Job.objects.filter(kind='extract_metadata').exists())
+
+        response = self.client.get(reverse('pics', args=[self.album.id]), {'sort': 'taken'})
+        self.assertEqual(response.context['indexing'], 1)
+        self.assertContains(response, '1 photo still being indexed')
+        self.assertNotContains(response, reverse('delete_images', args=[Image.objects.get().id]))
+        self.client.get(reverse('pics', args=[self.album.id]), {'sort': 'taken'})
+        self.assertEqual(Job.objects.filter(kind='extract_metadata').count(), 1)
+
+        jobs.run_pending()
+        image = Image.objects.get(albums=self.album)
+        self.assertEqual(image.captured_at.year, 2019)
+        ##the cached grid was retired with the update
+        response = self.client.get(reverse('pics', args=[self.album.id]), {'sort': 'taken'})
+        self.assertEqual(response.context['indexing'], 0)
+        self.assertContains(response, reverse('delete_images', args=[image.id]))
+
+    def test_command_backfills_and_skips_unreadable_originals(self):
+        Image.objects.bulk_create([Image(albums=self.album, image='images/missing.jpg', status=Image.READY)])
+        self.upload(make_upload(size=(300, 200), color='red', taken='2019:06:20 09:00:00'))
+        Image.objects.update(captured_at=None, metadata_at=None)
+
+        out = StringIO()
+        call_command('extract_metadata', '--album', str(self.album.id), stdout=out)
+
+        self.assertIn('Extracted metadata for 2 images', out.getvalue())
+        self.assertFalse(Image.objects.filter(metadata_at__isnull=True).exists())
+        self.assertEqual(Image.objects.filter(captured_at__year=2019).count(), 1)
+
+
+class ExportTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.upload(*[make_upload(f'{i}.jpg', size=(300, 200), color=(i * 60, 0, 0)) for i in range(3)])
+        self.images = list(Image.objects.filter(albums=self.album).order_by('created_at', 'id'))
+
+    def download(self, **params):
+        response = self.client.get(reverse('export_album', args=[self.album.id]), params)
+        self.assertTrue(response.streaming)
+        pieces = list(response.streaming_content)
+        return response, pieces, zipfile.ZipFile(BytesIO(b''.join(pieces)))
+
+    def test_streams_the_originals(self):
+        with mock.patch.object(exports, 'READ_SIZE', 256):
+            response, pieces, archive = self.download()
+
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="trip.zip"')
+        ##written out as it goes, not built up front
+        self.assertGreater(len(pieces), len(self.images))
+        self.assertEqual(archive.namelist(), ['trip/00001.jpg', 'trip/00002.jpg', 'trip/00003.jpg'])
+        for name, image in zip(archive.namelist(), self.images):
+            with image.image.open('rb') as fh:
+                self.assertEqual(archive.read(name), fh.read())
+        self.assertIsNone(archive.testzip())
+
+    def test_rendition_size_and_missing_files(self):
+        os.remove(self.images[1].image.path)
+        response, pieces, archive = self.download()
+        self.assertEqual(archive.namelist(), ['trip/00001.jpg', 'trip/00003.jpg', 'missing.txt'])
+
+        response, pieces, archive = self.download(size='tile')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="trip-tile.zip"')
+        self.assertEqual(len(archive.namelist()), 3)
+        self.assertEqual(PILImage.open(BytesIO(archive.read('trip/00002.jpg'))).size, (200, 200))
+        self.assertEqual(self.client.get(reverse('export_album', args=[self.album.id]), {'size': 'huge'}).status_code, 400)
+
+    def test_pictures_taken_before_1980(self):
+        Image.objects.filter(id=self.images[0].id).update(captured_at=datetime(1975, 6, 1, tzinfo=timezone.utc))
+        response, pieces, archive = self.download()
+
+        self.assertEqual(len(archive.namelist()), 3)
+        self.assertEqual(archive.getinfo('trip/00001.jpg').date_time, (1980, 1, 1, 0, 0, 0))
+        self.assertIsNone(archive.testzip())
+
+    def test_only_the_owner_can_export(self):
+        self.client.force_login(User.objects.create_user('bob', 'bob@example.com', 'pass12345'))
+        self.assertEqual(self.client.get(reverse('export_album', args=[self.album.id])).status_code, 404)
+
+    def test_command(self):
+        output = os.path.join(tempfile.mkdtemp(), 'out.zip')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output), True)
+        with mock.patch.object(exports, 'BATCH', 2):
+            call_command('export_album', str(self.album.id), output, '--size', 'gallery', stdout=StringIO())
+
+        with zipfile.ZipFile(output) as archive:
+            self.assertEqual(len(archive.namelist()), 3)
+
+
+class StorageBackendTests(LibraryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, True)
+
+    def test_batch_operations_on_any_backend(self):
+        for backend in (FileSystemStorage(self.location), backends.LocalStorage(self.location)):
+            names = storage.save_many([(f'x/{i}.txt', ContentFile(str(i).encode())) for i in range(5)], backend)
+            self.assertEqual(names, [f'x/{i}.txt' for i in range(5)])
+            self.assertEqual(storage.exists_many(names + ['x/nope.txt'], backend),
+                             dict({name: True for name in names}, **{'x/nope.txt': False}))
+            storage.delete_many(names, backend)
+            self.assertFalse(any(storage.exists_many(names, backend).values()))
+
+    def test_fake_s3_batches_requests(self):
+        bucket = backends.FakeS3Storage(self.location)
+        names = storage.save_many([(f'x/{i}.txt', ContentFile(b'x')) for i in range(3)], bucket)
+        with mock.patch.object(backends.FakeS3Storage, 'BATCH', 2), \
+                mock.patch.object(backends.FakeS3Storage, '_round_trip') as round_trip:
+            self.assertTrue(all(storage.exists_many(names, bucket).values()))
+            storage.delete_many(names, bucket)
+        self.assertEqual(round_trip.call_count, 4)
+        self.assertEqual(os.listdir(os.path.join(self.location, 'x')), [])
+
+    def test_media_path_runs_on_fake_s3(self):
+        with self.settings(DEFAULT_FILE_STORAGE='library_app.backends.FakeS3Storage', FAKE_S3_LATENCY_MS=1):
+            self.upload(make_upload(size=(300, 200)))
+            image = Image.objects.get(albums=self.album)
+            files = [image.image.name] + list(Rendition.objects.values_list('file', flat=True))
+            self.assertTrue(all(storage.exists_many(files).values()))
+
+            self.client.post(reverse('delete_album', args=[self.album.id]))
+            jobs.run_pending()
+            self.assertFalse(any(storage.exists_many(files).values()))
+
+    def test_build_renditions_verifies_files(self):
+        self.upload(make_upload(size=(300, 200)))
+        lost = Rendition.objects.get(size='tile', format='jpeg')
+        os.remove(lost.file.path)
+
+        out = StringIO()
+        call_command('build_renditions', '--verify', stdout=out)
+        self.assertIn('1 files have renditions missing', out.getvalue())
+        self.assertTrue(all(storage.exists_many(Rendition.objects.values_list('file', flat=True)).values()))
@@ -0,0 +1,127 @@
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .jobs import discard, enqueue, spool
+from .models import Album, Image, UploadSession
+
+
+##the client sends a file as a series of PUTs with a Content-Range header, each one is
+##copied from the socket to the session's .part file in small reads, so a worker never
+##holds more than READ_SIZE bytes of an upload however large the file or the batch is
+READ_SIZE = 64 * 1024
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def lock_album(album_id):
+    ##runs first in the transaction that adds pictures: the row lock makes it wait for a delete
+    ##that is being requested, and once the album is marked for deletion nothing is added to it
+    if not Album.objects.select_for_update().filter(id=album_id, deleting=False).exists():
+        raise UploadError('album is being deleted', status=409)
+
+
+def start(user, albums, filename, size):
+    if albums.deleting:
+        raise UploadError('album is being deleted', status=409)
+    if size <= 0:
+        raise UploadError('empty file')
+    if size > settings.UPLOAD_MAX_SIZE:
+        raise UploadError('file too large', status=413)
+    os.makedirs(settings.UPLOAD_SPOOL_DIR, exist_ok=True)
+    session = UploadSession.objects.create(
+        user=user,
+        albums=albums,
+        filename=os.path.basename(filename)[:255] or 'upload',
+        size=size,
+    )
+    open(session.path, 'wb').close()
+    return session
+
+
+def parse_range(header, length):
+    match = CONTENT_RANGE.match(header or '')
+    if not match:
+        raise UploadError('missing or malformed Content-Range')
+    first, last, total = (int(value) for value in match.groups())
+    if last < first or last - first + 1 != length:
+        raise UploadError('Content-Range does not match the body')
+    return first, last, total
+
+
+def write_chunk(session, stream, content_range, length):
+    if length > settings.UPLOAD_CHUNK_SIZE:
+        raise UploadError('chunk too large', status=413)
+    first, last, total = parse_range(content_range, length)
+    if total != session.size or last >= session.size:
+        raise UploadError('Content-Range does not match the upload')
+    if first != session.received:
+        ##the client resumes from the offset it gets back with the 409
+        raise UploadError('expected offset %d' % session.received, status=409)
+
+    with open(session.path, 'r+b') as out:
+        out.seek(first)
+        remaining = length
+        while remaining:
+            data = stream.read(min(READ_SIZE, remaining))
+            if not data:
+                raise UploadError('connection closed mid-chunk')
+            out.write(data)
+            remaining -= len(data)
+        out.truncate()
+
+    ##compare-and-swap on the offset, of two requests racing for the same chunk only one counts
+    moved = UploadSession.objects.filter(id=session.id, received=first).update(
+        received=last + 1,
+        updated_at=timezone.now(),
+    )
+    if not moved:
+        raise UploadError('chunk was already received', status=409)
+    session.received = last + 1
+    return session
+
+
+def finish(session):
+    ##the finished file joins the same job queue as a form upload
+    if session.received != session.size:
+        raise UploadError('upload is incomplete', status=409)
+    ##the .part file is local to this machine, the job may run on another one
+    with open(session.path, 'rb') as fh:
+        name, = spool([File(fh, name=session.filename)])
+    try:
+        with transaction.atomic():
+            if not UploadSession.objects.filter(id=session.id).delete()[0]:
+                raise UploadError('upload was already finished', status=409)
+            lock_album(session.albums_id)
+            image = Image.objects.create(albums=session.albums, status=Image.PENDING)
+            enqueue('process_upload', image_id=image.id, name=name, filename=session.filename)
+    except UploadError:
+        discard(name)
+        raise
+    os.remove(session.path)
+    return image
+
+
+def expire(older_than):
+    ##drops uploads the client gave up on, together with their .part files
+    cutoff = timezone.now() - older_than
+    count = 0
+    for session in UploadSession.objects.filter(updated_at__lt=cutoff):
+        try:
+            os.remove(session.path)
+        except FileNotFoundError:
+            pass
+        session.delete()
+        count += 1
+    return count
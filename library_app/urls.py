@@ -7,8 +7,13 @@ urlpatterns = [
     path('view/', views.viewAlbums, name="view"),
     path('gallery/<int:id>', views.viewGallery, name ='gallery' ),
     path('delete_album/<int:id>', views.delete_album, name = 'delete_album'),
+    path('export/<int:id>', views.exportAlbum, name = 'export_album'),
     path('delete_images/<int:id>', views.delete_images, name = 'delete_images'),
     path('upload/<int:id>', views.addImages, name = 'upload'),
+    path('upload/<int:id>/start', views.startUpload, name = 'upload_start'),
+    path('uploads/<uuid:upload_id>', views.uploadChunk, name = 'upload_chunk'),
+    path('uploads/<uuid:upload_id>/finish', views.finishUpload, name = 'upload_finish'),
     path('pics/<int:id>', views.viewPicturesByAlbum, name="pics"),
+    path('pics/<int:id>/page', views.imagesPage, name="pics_page"),
     
 ]
\ No newline at end of file
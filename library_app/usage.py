@@ -0,0 +1,34 @@
+from django.db.models import F
+from django.db.models.functions import Greatest
+from users_app.models import Profile
+
+from .models import Album
+
+
+##keeps Album and Profile usage counters in step with stored pictures. callers run it in the
+##same transaction as the write it accounts for; reconcile_usage rebuilds the counters from scratch.
+##a picture counts once it has a stored original, deduplicated bytes count for every album holding them
+
+
+def add(album_id, count, size):
+    if not count and not size:
+        return
+    ##never below zero: pictures from before the counters existed are only counted once
+    ##reconcile_usage has run, deleting one earlier must not fail
+    changes = {
+        'image_count': Greatest(F('image_count') + count, 0),
+        'bytes_used': Greatest(F('bytes_used') + size, 0),
+    }
+    Album.objects.filter(id=album_id).update(**changes)
+    Profile.objects.filter(user__album__id=album_id).update(**changes)
+
+
+def remove(images):
+    ##images about to be deleted, only those that were counted are taken off
+    totals = {}
+    for image in images:
+        if image.image:
+            count, size = totals.get(image.albums_id, (0, 0))
+            totals[image.albums_id] = (count + 1, size + image.size)
+    for album_id, (count, size) in totals.items():
+        add(album_id, -count, -size)
@@ -4,9 +4,195 @@ from .forms import createCollection
 # import boto3
 # from decouple import config
 
+from datetime import datetime, time, timedelta
+
 from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.http import urlencode
+from . import blobs, exports, fragments
+from .loaders import user_album, user_image
 from .models import Album
 from .models import Image
+from .models import UploadSession
+from . import uploads
+from .jobs import enqueue, queued, spool
+from .pagination import CursorPage, InvalidCursor
+from .renditions import RENDITION_SIZES, attach_renditions, renditions_for
+from .storage import delete_many, purge
+
+
+##partials shared by the full pages and the infinite scroll endpoint
+LAYOUTS = {
+    'grid': 'collections/_image_cards.html',
+    'gallery': 'collections/_gallery_items.html',
+}
+##the first page of each layout, wrapped with the infinite scroll sentinel
+GRIDS = {
+    'grid': 'collections/_album_grid.html',
+    'gallery': 'collections/_gallery_grid.html',
+}
+
+
+##keyset orderings of album pages, backed by image_album_created_idx and image_album_captured_idx
+SORTS = {
+    'uploaded': ('created_at', 'id'),
+    'taken': ('captured_at', 'id'),
+}
+IMAGE_ORDERING = SORTS['uploaded']
+
+
+##?sort=taken&from=2019-06-01&to=2019-06-30 on the album pages, anything unknown is ignored
+def listing_options(params):
+    options = {'sort': params.get('sort') if params.get('sort') in SORTS else 'uploaded'}
+    for bound in ('from', 'to'):
+        try:
+            day = parse_date(params.get(bound) or '')
+        except ValueError:
+            day = None
+        if day is not None:
+            options[bound] = day
+    return options
+
+
+def listing_key(options):
+    ##extra parts of the fragment cache keys, none for the default listing
+    if options is None or options == {'sort': 'uploaded'}:
+        return ()
+    return tuple(options.get(part) or '' for part in ('sort', 'from', 'to'))
+
+
+def listing_params(options):
+    params = {'sort': options['sort']} if options and options['sort'] != 'uploaded' else {}
+    for bound in ('from', 'to'):
+        if options and options.get(bound):
+            params[bound] = options[bound].isoformat()
+    return params
+
+
+def album_images(albums, layout='grid', options=None):
+    images = Image.objects.filter( albums = albums.id )
+    if layout == 'gallery':
+        images = images.filter( status = Image.READY )
+    options = options or {'sort': 'uploaded'}
+    ##pictures without a capture time are left out of the dated listings, a null would
+    ##also break the keyset comparisons of CursorPage
+    if options['sort'] == 'taken' or options.get('from') or options.get('to'):
+        images = images.filter( captured_at__isnull = False )
+    ##whole days in the site's zone, as ranges so the index is used
+    if options.get('from'):
+        images = images.filter( captured_at__gte = timezone.make_aware(datetime.combine(options['from'], time.min)) )
+    if options.get('to'):
+        images = images.filter( captured_at__lt = timezone.make_aware(datetime.combine(options['to'] + timedelta(days=1), time.min)) )
+    return images
+
+
+##dated listings need the exif columns, pictures stored before they were read at upload
+##are queued for extraction the first time someone asks
+def queue_metadata(albums, options):
+    if not listing_key(options):
+        return 0
+    missing = Image.objects.filter( albums = albums.id, metadata_at__isnull = True ).exclude( image = '' ).count()
+    if missing:
+        if not queued('extract_metadata', album_id = albums.id):
+            enqueue('extract_metadata', album_id = albums.id)
+    return missing
+
+
+##latest pictures shown under each album on the overview
+PREVIEW_COUNT = 3
+
+
+def user_albums(user):
+    return Album.objects.filter( user = user ).order_by('created_at', 'id')
+
+
+##the overview: every album with its last upload and the names of its newest pictures, as
+##correlated subqueries on image_album_created_idx so it is one query for any number of albums.
+##the picture count is Album.image_count
+def album_overview(user):
+    images = Image.objects.filter( albums = OuterRef('pk') ).order_by()
+    newest = images.filter( status = Image.READY ).order_by('-created_at', '-id')
+    previews = {
+        f'preview_{i}': Subquery(newest.values('image')[i:i + 1])
+        for i in range(PREVIEW_COUNT)
+    }
+    return user_albums(user).annotate(
+        latest_upload = Subquery(images.order_by('-created_at', '-id').values('created_at')[:1]),
+        **previews
+    )
+
+
+##one page of an album, the full views render the first and main.js fetches the rest
+def album_page(albums, layout='grid', cursor=None, options=None):
+    options = options or {'sort': 'uploaded'}
+    page = CursorPage(album_images(albums, layout, options), cursor, ordering=SORTS[options['sort']])
+    attach_renditions(page.items)
+
+    next_url = None
+    if page.has_next:
+        next_url = reverse('pics_page', args=[albums.id]) + '?' + urlencode({
+            'layout': layout,
+            'cursor': page.next_cursor,
+            **listing_params(options),
+        })
+    return {
+        'images': page.items,
+        'albums': albums,
+        'next_url': next_url,
+        'processing': any(image.status == Image.PENDING for image in page.items),
+    }
+
+
+##rendered first page of an album, cached until the album or one of its images changes
+def album_grid(albums, layout='grid', options=None):
+    return fragments.cached(
+        fragments.key('album', albums.id, layout, *listing_key(options), current = albums.fragment_version),
+        lambda: render_to_string(GRIDS[layout], album_page(albums, layout, options=options)),
+    )
+
+
+##the sort and date filter bar above an album, outside the cached grid
+def album_listing(request, albums):
+    options = listing_options(request.GET)
+    return {
+        'listing': options,
+        'sorts': {
+            sort: '?' + urlencode(listing_params(dict(options, sort=sort)))
+            for sort in SORTS
+        },
+        'indexing': queue_metadata(albums, options),
+    }
+
+
+def albums_list(user):
+    return fragments.cached(
+        fragments.key('user', user.id, 'albums', current = user.profile.fragment_version),
+        lambda: render_to_string('collections/_album_list.html', {
+            'albums': attach_previews(album_overview(user)),
+        }),
+    )
+
+
+##covers and previews of the whole overview in one rendition query
+def attach_previews(albums):
+    albums = list(albums)
+    names = {
+        album.id: [getattr(album, f'preview_{i}') for i in range(PREVIEW_COUNT) if getattr(album, f'preview_{i}')]
+        for album in albums
+    }
+    found = renditions_for(
+        [album.album_cover.name for album in albums] + [name for previews in names.values() for name in previews]
+    )
+    attach_renditions(albums, field='album_cover', found=found)
+    for album in albums:
+        album.previews = [found[name]['tile'] for name in names[album.id] if 'tile' in found[name]]
+    return albums
 
 
 @login_required
@@ -21,52 +207,67 @@ def createAlbum(request):
         title = request.POST.get('title')
         album_cover = request.FILES.get('album_cover')
         user = request.user
-        new_album = Album.objects.create(
-            title = title,
-            album_cover = album_cover,
-            user = user
-        )
-        albums = Album.objects.get(id = new_album.id)
+        with transaction.atomic():
+            new_album = Album.objects.create(
+                title = title,
+                user = user
+            )
+            if album_cover:
+                ##covers share stored bytes and renditions with identical images (blobs.py)
+                new_album.album_cover.name = blobs.store(album_cover, album_cover.name)
+                new_album.save(update_fields=['album_cover'])
+                enqueue('cover_renditions', album_id = new_album.id)
 
         context = {
-            "albums" : albums,
+            "albums" : new_album,
+            "grid": album_grid(new_album),
         }
         return render(request, 'collections/view_images.html', context )
     else:
         return render(request, 'collections/create_album.html' )
   
 
-##deletes the album and images associated
+##hides the album and hands the deletion of its images and files to the job queue
+@login_required
 def delete_album(request, id):
-    albums = Album.objects.get(id = id)
-    images = Image.objects.filter( albums = albums.id )
-    # s3 = boto3.resource('s3')
-    # for image in images:
-    #     s3.Object('django-image-library', image.image.name).delete()
-    #     print(image.image.name)
-    # s3.Object('django-image-library', albums.album_cover.name).delete()
-    albums.delete()
-    # # bucket = s3.Bucket('django-image-library')
-    # # for x in bucket.objects.all():
-    # #     print(x)
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    albums = user_album(request.user, id)
+    ##the flag is claimed in one update, of two requests racing each other only one queues the job
+    with transaction.atomic():
+        claimed = Album.objects.filter(id = albums.id, deleting = False).update(
+            deleting = True, updated_at = timezone.now())
+        if claimed:
+            fragments.invalidate_album(albums)
+            enqueue('delete_album', album_id = albums.id)
     return redirect('view')
 
+##the album as a zip streamed while it is written, of the originals or of ?size=<rendition>
+@login_required
+def exportAlbum(request, id):
+    albums = user_album(request.user, id)
+    size = request.GET.get('size') or None
+    if size is not None and size not in RENDITION_SIZES:
+        return JsonResponse({'error': 'unknown size'}, status=400)
+
+    response = StreamingHttpResponse(exports.stream(albums, size), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{exports.filename(albums, size)}"'
+    return response
+
 @login_required
 def delete_images(request, id):
-    image = Image.objects.get(id = id)
-    albums = Album.objects.get(id = image.albums.id)
-    # s3 = boto3.resource('s3')
-    # bucket = s3.Bucket('django-image-library')
-    # for x in bucket.objects.all():
-    #     print(x)
-    # s3.Object('django-image-library', image.image.name).delete()
-    image.delete()
+    image = user_image(request.user, id)
+    albums = image.albums
+    with transaction.atomic():
+        _, names = blobs.remove_images(Image.objects.filter(id = image.id))
+    purge(names)
+    ##the delete bumped the album's fragment_version, the grid is keyed on the new one
+    albums.refresh_from_db(fields = ['fragment_version'])
 
-    images = Image.objects.filter( albums = albums.id )
     context = {
-        'images' : images,
         'albums': albums,
-            }
+        'grid': album_grid(albums),
+    }
 
     return render(request, 'collections/view_images.html', context )
 
@@ -75,9 +276,8 @@ def delete_images(request, id):
 def viewAlbums(request):
 
     user = request.user
-    albums = Album.objects.filter(user = request.user)
     context = {
-            'albums' : albums,
+            'grid' : albums_list(user),
             'user': user,
         }
     return render(request, 'collections/view_albums.html', context )
@@ -86,30 +286,57 @@ def viewAlbums(request):
 @login_required
 def viewPicturesByAlbum (request, id): 
     
-    albums = Album.objects.get(id = id)
-    images = Image.objects.filter( albums = albums.id )
-
+    albums = user_album(request.user, id)
+    listing = album_listing(request, albums)
     context = {
-
-            'images' : images,
-            'albums': albums,
-        }
+        'albums': albums,
+        'grid': album_grid(albums, options=listing['listing']),
+        **listing,
+    }
 
     return render(request, 'collections/view_images.html', context )
 
 @login_required
 def viewGallery(request, id):
 
-    albums = Album.objects.get(id = id)
-    images = Image.objects.filter( albums = albums.id )
-
+    albums = user_album(request.user, id)
+    listing = album_listing(request, albums)
     context = {
+        'albums': albums,
+        'grid': album_grid(albums, layout='gallery', options=listing['listing']),
+        **listing,
+    }
 
-            'images' : images,
-            'albums': albums,
+    return render(request, 'collections/fluid-gallery.html', context )
+
+##next page of an album as json, for the infinite scroll in main.js
+@login_required
+def imagesPage(request, id):
+
+    layout = request.GET.get('layout', 'grid')
+    if layout not in LAYOUTS:
+        return JsonResponse({'error': 'unknown layout'}, status=400)
+    albums = user_album(request.user, id)
+    cursor = request.GET.get('cursor')
+    options = listing_options(request.GET)
+
+    def render_page():
+        context = album_page(albums, layout, cursor, options)
+        return {
+            'html': render_to_string(LAYOUTS[layout], context),
+            'count': len(context['images']),
+            'next': context['next_url'],
         }
 
-    return render(request, 'collections/fluid-gallery.html', context )
+    try:
+        page = fragments.cached(
+            fragments.key('album', albums.id, layout, cursor, *listing_key(options), current = albums.fragment_version),
+            render_page,
+        )
+    except InvalidCursor:
+        return JsonResponse({'error': 'invalid cursor'}, status=400)
+
+    return JsonResponse(page)
 
 
 
@@ -117,28 +344,96 @@ def viewGallery(request, id):
 def addImages(request, id):
 
     if request.method == 'POST':
-        albums = Album.objects.get(id = id)
-        for afile in request.FILES.getlist('image_file'):
-      
-            Image.objects.create(
-                image = afile,
-                albums = albums
-            )
-            
-        images = Image.objects.filter( albums = albums.id )
-        context = {
+        albums = user_album(request.user, id)
+        if albums.deleting:
+            return HttpResponse('album is being deleted', status=409)
+        ##files are only spooled here, storage writes and resizing run on the job queue
+        afiles = request.FILES.getlist('image_file')
+        names = spool(afiles)
+        try:
+            with transaction.atomic(), fragments.batched():
+                uploads.lock_album(albums.id)
+                for afile, name in zip(afiles, names):
+                    image = Image.objects.create(
+                        albums = albums,
+                        status = Image.PENDING
+                    )
+                    enqueue('process_upload', image_id = image.id, name = name, filename = afile.name)
+        except uploads.UploadError as e:
+            ##marked for deletion while the files were being spooled
+            delete_many(names)
+            return HttpResponse(str(e), status=e.status)
+        albums.refresh_from_db(fields = ['fragment_version'])
 
-            'images' : images,
+        context = {
             'albums': albums,
-            }
+            'grid': album_grid(albums),
+        }
 
         return render(request, 'collections/view_images.html', context )
 
     else:
-        albums = Album.objects.get(id = id)
+        albums = user_album(request.user, id)
         context = {
             'albums': albums,
         }
 
-        return render(request, 'collections/add_images.html', context) 
-    
\ No newline at end of file
+        return render(request, 'collections/add_images.html', context)
+
+
+##chunked uploads, used by the add images page when the browser supports it (see uploads.py)
+@login_required
+def startUpload(request, id):
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    albums = user_album(request.user, id)
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'error': 'size required'}, status=400)
+    try:
+        session = uploads.start(request.user, albums, request.POST.get('filename', ''), size)
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+
+    return JsonResponse({
+        'url': reverse('upload_chunk', args=[session.id]),
+        'finish': reverse('upload_finish', args=[session.id]),
+        'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+        'received': session.received,
+    }, status=201)
+
+##GET tells the client where to resume, PUT appends one chunk of the body
+@login_required
+def uploadChunk(request, upload_id):
+
+    session = UploadSession.objects.filter(id = upload_id, user = request.user).first()
+    if session is None:
+        return JsonResponse({'error': 'unknown upload'}, status=404)
+
+    if request.method == 'PUT':
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+            uploads.write_chunk(session, request, request.META.get('HTTP_CONTENT_RANGE'), length)
+        except uploads.UploadError as e:
+            return JsonResponse({'error': str(e), 'received': session.received}, status=e.status)
+    elif request.method != 'GET':
+        return JsonResponse({'error': 'GET or PUT required'}, status=405)
+
+    return JsonResponse({'received': session.received, 'size': session.size})
+
+@login_required
+def finishUpload(request, upload_id):
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    session = UploadSession.objects.filter(id = upload_id, user = request.user).first()
+    if session is None:
+        return JsonResponse({'error': 'unknown upload'}, status=404)
+    try:
+        image = uploads.finish(session)
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e), 'received': session.received}, status=e.status)
+
+    return JsonResponse({'image': image.id, 'album': reverse('pics', args=[session.albums_id])})
@@ -0,0 +1 @@
+default_app_config = 'quartz_app.apps.QuartzAppConfig'
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class QuartzAppConfig(AppConfig):
     name = 'quartz_app'
+
+    def ready(self):
+        ##template time for the instrumentation middleware
+        from django.template.backends.django import Template
+        from .metrics import timed_render
+        Template.render = timed_render(Template.render)
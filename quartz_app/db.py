@@ -0,0 +1,104 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+
+logger = logging.getLogger(__name__)
+
+##always read from the primary: a session or user written a moment ago may not have reached a replica
+PRIMARY_APPS = {'sessions', 'auth'}
+
+_local = threading.local()
+_lock = threading.Lock()
+##replica alias -> time.monotonic() until which it is skipped after failing its health check
+_down = {}
+
+
+def begin(replica=False):
+    ##called by DatabaseRoutingMiddleware for every request, see REPLICA_VIEWS in settings
+    _local.replica = replica
+    _local.wrote = False
+    _local.chosen = None
+
+
+def end():
+    begin()
+
+
+@contextmanager
+def primary():
+    ##reads inside the block go to the primary whatever the request was routed to
+    replica = getattr(_local, 'replica', False)
+    _local.replica = False
+    try:
+        yield
+    finally:
+        _local.replica = replica
+
+
+def choose_replica():
+    ##one healthy replica per request, so a page reads one consistent snapshot. None means the primary
+    if getattr(_local, 'chosen', None) is None:
+        candidates = [alias for alias in settings.DATABASE_REPLICAS if _down.get(alias, 0) <= time.monotonic()]
+        random.shuffle(candidates)
+        _local.chosen = next((alias for alias in candidates if healthy(alias)), '')
+    return _local.chosen or None
+
+
+def healthy(alias):
+    connection = connections[alias]
+    try:
+        check_connection(connection)
+        connection.ensure_connection()
+        return True
+    except DatabaseError as error:
+        logger.warning('Replica %s is unavailable, reading from the primary for %ss: %s',
+                       alias, settings.REPLICA_RETRY_SECONDS, error)
+        with _lock:
+            _down[alias] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+        connection.close()
+        return False
+
+
+def check_connection(connection):
+    ##persistent connections (CONN_MAX_AGE) can be closed under us by a server restart, a failover
+    ##or the pooler; an idle one is pinged at most every DATABASE_HEALTH_CHECK_SECONDS and dropped
+    ##when it is dead, so the next query opens a fresh one instead of failing
+    if connection.connection is None or connection.in_atomic_block:
+        return
+    now = time.monotonic()
+    if now - getattr(connection, 'health_checked_at', 0) < settings.DATABASE_HEALTH_CHECK_SECONDS:
+        return
+    connection.health_checked_at = now
+    if not connection.is_usable():
+        connection.close()
+
+
+def check_connections():
+    for connection in connections.all():
+        check_connection(connection)
+
+
+##sends the reads of the listing views to a replica and everything else to the primary. once a
+##request has written, its reads stay on the primary too (select_for_update counts as a write)
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if not getattr(_local, 'replica', False) or _local.wrote or model._meta.app_label in PRIMARY_APPS:
+            return None
+        return choose_replica()
+
+    def db_for_write(self, model, **hints):
+        _local.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
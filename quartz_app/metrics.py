@@ -0,0 +1,206 @@
+import functools
+import logging
+import re
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict, deque
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils.functional import empty
+
+
+logger = logging.getLogger(__name__)
+
+##what one request cost, kept per url name (see middleware.py)
+FIELDS = ('wall_ms', 'queries', 'db_ms', 'template_ms', 'storage_calls', 'bytes')
+
+##storage methods that reach the backend, url() only builds a string
+STORAGE_METHODS = ('open', 'save', 'delete', 'exists', 'size', 'listdir', 'batch_delete', 'batch_exists')
+
+##repeated SQL only shows up once a page lists something, long IN (...) lists are one shape
+IN_LIST = re.compile(r'IN \((%s, )*%s\)')
+
+_local = threading.local()
+_lock = threading.Lock()
+_routes = OrderedDict()
+_slow = deque(maxlen=50)
+
+
+class Ring:
+    ##the last `size` values of every field in flat arrays of doubles, overwritten in place
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.values = {field: array('d', [0.0]) * size for field in FIELDS}
+        self.repeated = Counter()
+
+    def add(self, sample):
+        slot = self.count % self.size
+        for field in FIELDS:
+            self.values[field][slot] = sample[field]
+        self.count += 1
+
+    def summary(self):
+        filled = min(self.count, self.size)
+        stats = {'requests': self.count}
+        for field in FIELDS:
+            values = sorted(self.values[field][:filled])
+            stats[field] = {f'p{p}': round(_percentile(values, p), 2) for p in (50, 90, 99)}
+        stats['n_plus_one'] = dict(self.repeated.most_common(10))
+        return stats
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+class Recording:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = Counter()
+        self.query_count = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.storage_calls = 0
+        self._storage_lock = threading.Lock()
+
+    def storage_call(self):
+        ##storage calls can come from a pool working for the request, see bind()
+        with self._storage_lock:
+            self.storage_calls += 1
+
+    def query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - start
+            self.query_count += 1
+            self.queries[IN_LIST.sub('IN (...)', sql)] += 1
+
+    def repeated(self):
+        threshold = settings.METRICS_N_PLUS_ONE
+        return {sql: count for sql, count in self.queries.items() if count >= threshold}
+
+
+def current():
+    return getattr(_local, 'recording', None)
+
+
+def start():
+    _local.recording = Recording()
+    return _local.recording
+
+
+def stop():
+    _local.recording = None
+
+
+def bind(func):
+    ##lets a worker thread count its storage calls towards the request that handed it the work
+    recording = current()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = current()
+        _local.recording = recording
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.recording = previous
+    return wrapper
+
+
+def record(route, recording, response_bytes):
+    sample = {
+        'wall_ms': (time.perf_counter() - recording.started) * 1000,
+        'queries': recording.query_count,
+        'db_ms': recording.db_seconds * 1000,
+        'template_ms': recording.template_seconds * 1000,
+        'storage_calls': recording.storage_calls,
+        'bytes': response_bytes,
+    }
+    repeated = recording.repeated()
+    with _lock:
+        ring = _routes.get(route)
+        if ring is None:
+            ring = _routes[route] = Ring(settings.METRICS_RING_SIZE)
+        ring.add(sample)
+        for sql in repeated:
+            ring.repeated[sql] += 1
+        if sample['wall_ms'] >= settings.METRICS_SLOW_MS or repeated:
+            _slow.append(dict(sample, route=route, repeated=repeated))
+    if sample['wall_ms'] >= settings.METRICS_SLOW_MS:
+        logger.warning('Slow request %s: %.0fms, %d queries (%.0fms), %d storage calls',
+                       route, sample['wall_ms'], sample['queries'], sample['db_ms'], sample['storage_calls'])
+    for sql, count in repeated.items():
+        logger.warning('%s ran the same query %d times: %s', route, count, sql)
+    return sample
+
+
+def snapshot():
+    with _lock:
+        return {
+            'routes': {route: ring.summary() for route, ring in _routes.items()},
+            'flagged': list(_slow),
+        }
+
+
+def reset():
+    with _lock:
+        _routes.clear()
+        _slow.clear()
+
+
+def timed_render(render):
+    ##wraps the template backend's render(), only the outermost render of a request is
+    ##timed so render_to_string inside a rendered page is not counted twice
+    @functools.wraps(render)
+    def wrapper(*args, **kwargs):
+        recording = current()
+        if recording is None or recording.template_depth:
+            return render(*args, **kwargs)
+        recording.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(*args, **kwargs)
+        finally:
+            recording.template_seconds += time.perf_counter() - start
+            recording.template_depth -= 1
+    return wrapper
+
+
+def meter_storage(storage):
+    ##counts backend calls on a storage instance. override_settings swaps the instance behind
+    ##default_storage, so the middleware calls this on every request and it is a no-op once metered
+    if getattr(storage, '_metered', False):
+        return storage
+    for name in STORAGE_METHODS:
+        method = getattr(storage, name, None)
+        if method is not None:
+            setattr(storage, name, _counted(method))
+    storage._metered = True
+    return storage
+
+
+def meter_default_storage():
+    if default_storage._wrapped is empty:
+        default_storage._setup()
+    return meter_storage(default_storage._wrapped)
+
+
+def _counted(method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        recording = current()
+        if recording is not None:
+            recording.storage_call()
+        return method(*args, **kwargs)
+    return wrapper
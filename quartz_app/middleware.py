@@ -0,0 +1,74 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import db, metrics
+
+
+##requests to these url names are not recorded
+IGNORED = {'metrics'}
+
+
+##records wall time, queries, template and storage time and response size of every request
+##under its url name; the numbers live in this process only, see metrics.py and /metrics/
+class InstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        metrics.meter_default_storage()
+        recording = metrics.start()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recording.query))
+                response = self.get_response(request)
+        finally:
+            metrics.stop()
+
+        match = request.resolver_match
+        route = (match.view_name or match._func_path) if match else 'unresolved'
+        if route not in IGNORED:
+            metrics.record(route, recording, 0 if response.streaming else len(response.content))
+        return response
+
+
+##a client that has just written reads from the primary until this cookie expires
+PIN_COOKIE = 'db_pin'
+
+
+##health checks the persistent connections and lets the read-only listing views (REPLICA_VIEWS)
+##use a replica, except for a client that wrote something in the last REPLICA_PIN_SECONDS
+class DatabaseRoutingMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        db.check_connections()
+        db.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            db.end()
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 and settings.DATABASE_REPLICAS:
+            response.set_cookie(PIN_COOKIE, str(int(time.time() + settings.REPLICA_PIN_SECONDS)),
+                                max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        try:
+            pinned = float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        db.begin(replica=(
+            request.method in ('GET', 'HEAD')
+            and request.resolver_match.url_name in settings.REPLICA_VIEWS
+            and not pinned
+        ))
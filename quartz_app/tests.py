@@ -1,3 +1,231 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import OperationalError, connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from library_app import fragments
+from library_app.models import Album, Image, Rendition
+
+from . import db, metrics
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    METRICS_N_PLUS_ONE=5,
+    METRICS_SLOW_MS=10 ** 6,
+)
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pass12345', is_staff=True)
+        self.client.force_login(self.user)
+        self.album = Album.objects.create(title='Trip', user=self.user)
+
+    def test_records_cost_per_url_name(self):
+        response = self.client.get(reverse('pics', args=[self.album.id]))
+        self.client.get(reverse('pics', args=[self.album.id]))
+
+        report = self.client.get(reverse('metrics')).json()
+        stats = report['routes']['pics']
+        self.assertEqual(stats['requests'], 2)
+        self.assertGreater(stats['queries']['p50'], 0)
+        self.assertGreater(stats['template_ms']['p50'], 0)
+        self.assertEqual(stats['bytes']['p50'], len(response.content))
+        self.assertNotIn('metrics', report['routes'])
+
+    def test_flags_repeated_queries(self):
+        recording = metrics.start()
+        try:
+            with connection.execute_wrapper(recording.query):
+                for album_id in range(6):
+                    Album.objects.filter(id=album_id).first()
+                Album.objects.filter(id__in=[1, 2, 3]).count()
+                Album.objects.filter(id__in=[4, 5]).count()
+        finally:
+            metrics.stop()
+
+        with self.assertLogs('quartz_app.metrics', 'WARNING'):
+            metrics.record('albums', recording, 0)
+
+        stats = metrics.snapshot()['routes']['albums']
+        self.assertEqual(stats['queries']['p50'], 8)
+        [(sql, requests)] = stats['n_plus_one'].items()
+        self.assertIn('WHERE "library_app_album"."id" = %s', sql)
+        self.assertEqual(metrics.snapshot()['flagged'][0]['route'], 'albums')
+
+    def test_counts_storage_calls(self):
+        name = default_storage.save('images/a.jpg', ContentFile(b'x'))
+        image = Image.objects.create(albums=self.album, image=name)
+        Rendition.objects.create(source=name, size='tile', file='renditions/a_tile.jpg', width=1, height=1)
+        self.client.get(reverse('delete_images', args=[image.id]))
+
+        ##both deletes run on the pool in library_app.storage.delete_many
+        stats = metrics.snapshot()['routes']['delete_images']
+        self.assertEqual(stats['storage_calls']['p50'], 2)
+
+    def test_report_is_staff_only(self):
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 302)
+
+
+@override_settings(DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage', MEDIA_MAX_AGE=60)
+class MediaServingTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, True)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.data = bytes(range(256)) * 4
+        self.name = default_storage.save('renditions/' + 'ab' * 32 + '_tile.0123456789ab.jpg', ContentFile(self.data))
+
+    def get(self, name=None, **headers):
+        response = self.client.get(reverse('media', args=[name or self.name]), **headers)
+        return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_hashed_names_are_immutable(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        legacy = default_storage.save('profile_pics/me.jpg', ContentFile(b'x'))
+        response, body = self.get(legacy)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+
+    def test_conditional_requests(self):
+        response, body = self.get()
+        etag = response['ETag']
+
+        response, body = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(response['ETag'], etag)
+        response, body = self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        response, body = self.get(HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_ranges(self):
+        response, body = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(response['Content-Length'], '10')
+
+        response, body = self.get(HTTP_RANGE='bytes=-4')
+        self.assertEqual(body, self.data[-4:])
+        response, body = self.get(HTTP_RANGE='bytes=1000-')
+        self.assertEqual(body, self.data[1000:])
+
+        response, body = self.get(HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+        ##a stale If-Range gets the whole file
+        response, body = self.get(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, len(body)), (200, 1024))
+
+    def test_missing_and_outside_media(self):
+        self.assertEqual(self.get('renditions/nope.jpg')[0].status_code, 404)
+        self.assertEqual(self.get('renditions')[0].status_code, 404)
+        self.assertIn(self.client.get('/media/../manage.py').status_code, (400, 404))
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    DATABASE_REPLICAS=['default'],
+)
+class DatabaseRoutingTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pass12345')
+        self.client.force_login(self.user)
+        self.album = Album.objects.create(title='Trip', user=self.user)
+        self.addCleanup(db.end)
+        self.addCleanup(db._down.clear)
+
+    def test_listing_views_read_from_a_replica(self):
+        ##the test replica mirrors the primary, what is checked is that the router asked for one
+        with mock.patch.object(db, 'choose_replica', wraps=db.choose_replica) as choose:
+            self.client.get(reverse('view'))
+            self.client.get(reverse('pics', args=[self.album.id]))
+            self.assertTrue(choose.called)
+            choose.reset_mock()
+            self.client.get(reverse('dashboard'))
+            self.assertFalse(choose.called)
+
+    def test_reads_stay_on_the_primary_after_a_write(self):
+        response = self.client.post(reverse('delete_album', args=[self.album.id]))
+        self.assertIn('db_pin', response.cookies)
+
+        with mock.patch.object(db, 'choose_replica', wraps=db.choose_replica) as choose:
+            self.client.get(reverse('view'))
+            self.assertFalse(choose.called)
+            self.client.cookies.pop('db_pin')
+            ##the album list cached by the first visit would answer without a query
+            fragments.get_cache().clear()
+            self.client.get(reverse('view'))
+            self.assertTrue(choose.called)
+
+    def test_router(self):
+        with mock.patch.object(db, 'healthy', return_value=True), \
+                self.settings(DATABASE_REPLICAS=['replica_test']):
+            db.begin(replica=True)
+            self.assertEqual(Image.objects.all().db, 'replica_test')
+            ##sessions and users are read where they were written
+            self.assertEqual(User.objects.all().db, 'default')
+            self.assertEqual(Image.objects.select_for_update().db, 'default')
+
+            Album.objects.filter(id=self.album.id).update(title='Renamed')
+            self.assertEqual(Image.objects.all().db, 'default')
+
+            db.begin()
+            self.assertEqual(Image.objects.all().db, 'default')
+
+    def test_missing_fragments_are_rendered_from_the_primary(self):
+        fragments.get_cache().clear()
+        with mock.patch.object(db, 'healthy', return_value=True), \
+                self.settings(DATABASE_REPLICAS=['replica_test']):
+            db.begin(replica=True)
+            self.assertEqual(fragments.cached('fragments:test', lambda: Image.objects.all().db), 'default')
+            self.assertEqual(fragments.cached('fragments:test', lambda: 'rendered again'), 'default')
+            ##the rest of the page still reads from the replica
+            self.assertEqual(Image.objects.all().db, 'replica_test')
+
+    def test_unhealthy_replica_is_skipped(self):
+        broken = mock.Mock(connection=None, in_atomic_block=False)
+        broken.ensure_connection.side_effect = OperationalError('connection refused')
+        with mock.patch.object(db, 'connections', {'replica_test': broken, 'default': connection}), \
+                self.settings(DATABASE_REPLICAS=['replica_test']):
+            db.begin(replica=True)
+            self.assertIsNone(db.choose_replica())
+            self.assertIn('replica_test', db._down)
+            ##not tried again until REPLICA_RETRY_SECONDS have passed
+            db.begin(replica=True)
+            self.assertIsNone(db.choose_replica())
+            self.assertEqual(broken.ensure_connection.call_count, 1)
+
+    def test_dead_persistent_connections_are_dropped(self):
+        stale = mock.Mock(spec=['connection', 'in_atomic_block', 'is_usable', 'close'],
+                          connection=object(), in_atomic_block=False)
+        stale.is_usable.return_value = False
+        db.check_connection(stale)
+        stale.close.assert_called_once_with()
+        ##pinged at most every DATABASE_HEALTH_CHECK_SECONDS
+        db.check_connection(stale)
+        self.assertEqual(stale.is_usable.call_count, 1)
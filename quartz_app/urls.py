@@ -1,8 +1,11 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
 
 path('', views.index, name='index'),
+path('metrics/', views.metrics_report, name='metrics'),
+path(settings.MEDIA_URL.lstrip('/') + '<path:path>', views.serve_media, name='media'),
 
 ]
\ No newline at end of file
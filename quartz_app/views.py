@@ -1,4 +1,106 @@
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.files.storage import default_storage
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+from library_app.storage import immutable
+
+from . import metrics
+
+##media names with a content hash are cached for a year and never revalidated
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+##single byte ranges only, a multi-range request gets the whole file (which the spec allows)
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+READ_SIZE = 64 * 1024
 
 def index(request):
-    return render(request, 'navigation/index.html')
\ No newline at end of file
+    return render(request, 'navigation/index.html')
+
+##per url name percentiles and the recently flagged requests of this process (quartz_app/metrics.py)
+@staff_member_required
+def metrics_report(request):
+    return JsonResponse(metrics.snapshot())
+
+##user media from a filesystem storage, for deployments without cloudinary. answers conditional
+##and range requests so browsers and a cdn in front can cache it; behind cloudinary the storage
+##has no local path and every url here is a 404
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = default_storage.path(path)
+        info = os.stat(full_path)
+    except (NotImplementedError, OSError):
+        raise Http404
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404
+
+    etag = f'"{info.st_size:x}-{info.st_mtime_ns:x}"'
+    if immutable(path):
+        cache_control = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        cache_control = f'public, max-age={settings.MEDIA_MAX_AGE}'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(info.st_mtime),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        fresh = if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+    else:
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        fresh = since is not None and int(info.st_mtime) <= since
+    if fresh:
+        return _with_headers(HttpResponseNotModified(), headers)
+
+    start, end = 0, info.st_size - 1
+    status = 200
+    byte_range = BYTE_RANGE.match(request.META.get('HTTP_RANGE', '').strip())
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if byte_range and any(byte_range.groups()) and (if_range is None or if_range.strip() == etag):
+        first, last = byte_range.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), info.st_size - 1) if last else info.st_size - 1
+        else:
+            start = max(info.st_size - int(last), 0)
+        if start > end or (not first and not int(last)):
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{info.st_size}'
+            return _with_headers(response, headers)
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{info.st_size}'
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    length = end - start + 1
+    if request.method == 'HEAD':
+        response = HttpResponse(status=status, content_type=content_type)
+    else:
+        response = StreamingHttpResponse(_read(full_path, start, length), status=status, content_type=content_type)
+    headers['Content-Length'] = str(length)
+    return _with_headers(response, headers)
+
+def _read(path, start, length):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(READ_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def _with_headers(response, headers):
+    for name, value in headers.items():
+        response[name] = value
+    return response
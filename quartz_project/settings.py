@@ -56,6 +56,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'quartz_app.middleware.InstrumentationMiddleware',
+    'quartz_app.middleware.DatabaseRoutingMiddleware',
 
 ]
 
@@ -72,6 +74,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'users_app.avatars.avatar',
             ],
         },
     },
@@ -102,7 +105,62 @@ DATABASES = {
         "PORT": "",
     }
 }
-DATABASES['default'] = dj_database_url.config(conn_max_age=600, ssl_require=True)
+DATABASES['default'] = dj_database_url.config(
+    default='sqlite:///' + os.path.join(BASE_DIR, 'db.sqlite3'),
+    conn_max_age=600,
+)
+
+##read replicas, comma separated database urls. the listing views read from them (quartz_app/db.py),
+##under test they mirror the primary. two sqlite files can stand in for primary and replica locally
+DATABASE_REPLICAS = []
+for i, url in enumerate(url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url):
+    DATABASES[f'replica_{i}'] = dj_database_url.parse(url, conn_max_age=600)
+    DATABASES[f'replica_{i}']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(f'replica_{i}')
+
+for database in DATABASES.values():
+    ##heroku postgres needs ssl, the local sqlite fallback (tests, benchmarks) does not understand it
+    if database['ENGINE'] != 'django.db.backends.sqlite3':
+        database.setdefault('OPTIONS', {})['sslmode'] = 'require'
+    ##pgbouncer in transaction mode hands each transaction to any server connection, which
+    ##named server-side cursors (QuerySet.iterator()) cannot survive
+    if os.environ.get('DATABASE_POOLER') == 'pgbouncer':
+        database['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+DATABASE_ROUTERS = ['quartz_app.db.ReplicaRouter']
+##url names whose reads may be served by a replica, they only read
+REPLICA_VIEWS = ['view', 'pics', 'gallery', 'pics_page']
+##after a write a client reads from the primary this long, longer than the replicas lag
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+##a replica that fails its health check is skipped this long
+REPLICA_RETRY_SECONDS = int(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+##idle persistent connections are pinged at most this often and reopened when dead
+DATABASE_HEALTH_CHECK_SECONDS = int(os.environ.get('DATABASE_HEALTH_CHECK_SECONDS', 30))
+
+
+# Caches
+# the fragments cache only holds rendered html, the versions that invalidate it are columns on Album and
+# Profile (library_app/fragments.py), so a per-process locmem cache (least recently used entries evicted)
+# is never stale. FRAGMENT_CACHE_BACKEND can point at library_app.fragments.LRUFileBasedCache (with
+# FRAGMENT_CACHE_LOCATION) to render each fragment once for all workers instead of once per worker
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+    },
+    'fragments': {
+        'BACKEND': os.environ.get('FRAGMENT_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('FRAGMENT_CACHE_LOCATION', 'fragments'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 2000)),
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+FRAGMENT_CACHE_ALIAS = 'fragments'
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
 
 
 # Password validation
@@ -148,6 +206,21 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+##browser cache lifetime of media served locally whose name has no content hash (quartz_app/views.py)
+MEDIA_MAX_AGE = int(os.environ.get('MEDIA_MAX_AGE', 3600))
+
+##background jobs (library_app/jobs.py): uploads are spooled to the media storage and processed by
+##JOB_WORKERS threads inside the web process, or by manage.py process_jobs. chunked uploads are
+##assembled in UPLOAD_SPOOL_DIR on local disk first
+UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR', os.path.join(BASE_DIR, 'spool'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = 3
+
+##chunked uploads (library_app/uploads.py): largest chunk accepted per request, largest file,
+##and how long an unfinished upload is kept before process_jobs removes it
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', 100 * 1024 * 1024))
+UPLOAD_SESSION_HOURS = int(os.environ.get('UPLOAD_SESSION_HOURS', 24))
 
 
 STATICFILES_DIRS = (
@@ -156,6 +229,17 @@ STATICFILES_DIRS = (
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
+##per-request instrumentation (quartz_app/metrics.py), staff can read it at /metrics/.
+##requests slower than METRICS_SLOW_MS or repeating one query METRICS_N_PLUS_ONE times are logged
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True') == 'True'
+METRICS_RING_SIZE = int(os.environ.get('METRICS_RING_SIZE', 512))
+METRICS_SLOW_MS = int(os.environ.get('METRICS_SLOW_MS', 500))
+METRICS_N_PLUS_ONE = int(os.environ.get('METRICS_N_PLUS_ONE', 5))
+
+##renditions are stored as jpeg plus these formats when the installed pillow can encode them
+##(library_app/renditions.py), browsers pick the first one they support from the <picture> markup
+RENDITION_FORMATS = [f for f in os.environ.get('RENDITION_FORMATS', 'avif,webp').split(',') if f]
+
 #this modifies the redirect after the login - very important -- change to any page
 LOGIN_REDIRECT_URL = 'profile'
 ##this tells django to look for the login page after using the decorator
@@ -180,7 +264,18 @@ CLOUDINARY_STORAGE ={
   'API_KEY': os.environ.get("API_KEY"),
   'API_SECRET': os.environ.get("API_SECRET")
 }
-DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+##where media is kept: cloudinary, local (MEDIA_ROOT) or fake-s3, a stand-in for an S3 bucket on local
+##disk that waits FAKE_S3_LATENCY_MS per request, to run and benchmark the media path offline
+STORAGE_BACKENDS = {
+    'cloudinary': 'cloudinary_storage.storage.MediaCloudinaryStorage',
+    'local': 'library_app.backends.LocalStorage',
+    'fake-s3': 'library_app.backends.FakeS3Storage',
+}
+MEDIA_STORAGE = os.environ.get('MEDIA_STORAGE', 'cloudinary')
+DEFAULT_FILE_STORAGE = STORAGE_BACKENDS[MEDIA_STORAGE]
+FAKE_S3_LATENCY_MS = float(os.environ.get('FAKE_S3_LATENCY_MS', 0))
+##storage requests library_app/storage.py runs at a time for one batch operation
+STORAGE_CONCURRENCY = int(os.environ.get('STORAGE_CONCURRENCY', 8))
 
 
 
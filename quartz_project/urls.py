@@ -16,8 +16,6 @@ Including another URLconf
 from django.contrib import admin
 from django.contrib.auth import views as auth_views
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
 
 
 urlpatterns = [
@@ -46,8 +44,3 @@ urlpatterns = [
     path('password_reset/', auth_views.PasswordResetView.as_view( template_name='users/password_reset_form.html'), name='password_reset'),
     
 ] 
-
-if settings.DEBUG:
-    
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-
@@ -1,6 +1,6 @@
 
     
-    $(".fb-share-button").on("click", function(event) {
+    $(document).on("click", ".fb-share-button", function(event) {
     if(event.target.tagName == 'BUTTON') {
         let url = event.target.closest('DIV').children[0].href
         let url2 = event.target.closest('DIV').children[0].dataset.href
@@ -12,7 +12,7 @@
     }   
 })
 
-$(".pinterest-share-button").on("click", function(event) {
+$(document).on("click", ".pinterest-share-button", function(event) {
     if(event.target.tagName == 'BUTTON') {
         let url = event.target.closest('DIV').children[0].href
         let url2 = event.target.closest('DIV').children[0].dataset.href
@@ -45,10 +45,38 @@ window.addEventListener('DOMContentLoaded', (event) => {
 
     let observer = new IntersectionObserver (beTouching, options);
 
-    document.querySelectorAll('.par').forEach(img => {
-      
-      observer.observe(img)
-    })
+    function observePar(root){
+      root.querySelectorAll('.par').forEach(img => {
+
+        observer.observe(img)
+      })
+      root.querySelectorAll('img[data-src]').forEach(img => {
+        loader.observe(img)
+      })
+    }
+
+    //deferred pictures ({% picture ... defer=True %}) show their inline blur-up preview until
+    //they come within a screen of the viewport, then get their real sources
+    let loader = new IntersectionObserver(loadPictures, { root: null, rootMargin: '600px 0px' })
+
+    function loadPictures(entries){
+      entries.forEach(obj => {
+        if(!obj.isIntersecting){
+          return
+        }
+        let img = obj.target
+        img.parentNode.querySelectorAll('source[data-srcset]').forEach(source => {
+          source.srcset = source.dataset.srcset
+          source.removeAttribute('data-srcset')
+        })
+        img.srcset = img.dataset.srcset
+        img.src = img.dataset.src
+        img.removeAttribute('data-srcset')
+        img.removeAttribute('data-src')
+        loader.unobserve(img)
+      })
+    }
+    observePar(document)
 
     function beTouching(entries){
       entries.forEach(obj => {
@@ -59,6 +87,49 @@ window.addEventListener('DOMContentLoaded', (event) => {
       })
     }
 
+    //infinite scroll: the .load-more sentinel holds the url of the next page (library_app.views.imagesPage)
+    let loading = false
+    let pager = new IntersectionObserver(loadMore, { root: null, rootMargin: '800px 0px' })
+
+    document.querySelectorAll('.load-more').forEach(sentinel => {
+      pager.observe(sentinel)
+    })
+
+    function loadMore(entries){
+      entries.forEach(obj => {
+        let sentinel = obj.target
+        if(!obj.isIntersecting || loading || !sentinel.dataset.next){
+          return
+        }
+        loading = true
+        fetch(sentinel.dataset.next, { credentials: 'same-origin', headers: { 'Accept': 'application/json' } })
+          .then(response => response.json())
+          .then(page => {
+            let target = document.querySelector(sentinel.dataset.target)
+            let holder = document.createElement('div')
+            holder.innerHTML = page.html
+            let added = Array.from(holder.children)
+            added.forEach(el => target.appendChild(el))
+            added.forEach(el => observePar(el))
+
+            if(window.baguetteBox){
+              baguetteBox.run('.tz-gallery')
+            }
+            if(page.next){
+              sentinel.dataset.next = page.next
+              //re-observing fires again right away if the sentinel is still on screen
+              pager.unobserve(sentinel)
+              pager.observe(sentinel)
+            } else {
+              pager.unobserve(sentinel)
+              sentinel.remove()
+            }
+          })
+          .finally(() => {
+            loading = false
+          })
+      })
+    }
 
 })
 
@@ -68,3 +139,92 @@ window.addEventListener('DOMContentLoaded', (event) => {
 
 
 
+//chunked uploads: forms with data-chunked send every file in slices to library_app.views.startUpload
+//and uploadChunk, so the server never buffers a whole file. without fetch the form posts as usual
+document.querySelectorAll('form[data-chunked]').forEach(form => {
+  if(!window.fetch || !window.FormData || !Blob.prototype.slice){
+    return
+  }
+  let token = form.querySelector('[name=csrfmiddlewaretoken]').value
+  let status = form.querySelector('.upload-status')
+  let button = form.querySelector('button[type=submit]')
+
+  function call(url, options){
+    options.credentials = 'same-origin'
+    options.headers = Object.assign({ 'X-CSRFToken': token }, options.headers || {})
+    return fetch(url, options).then(response => response.json().then(data => {
+      if(!response.ok){
+        let error = new Error(data.error)
+        error.status = response.status
+        error.received = data.received
+        throw error
+      }
+      return data
+    }))
+  }
+
+  function sendChunks(file, session, retries){
+    if(session.received >= file.size){
+      return call(session.finish, { method: 'POST' })
+    }
+    let end = Math.min(session.received + session.chunk_size, file.size)
+    return call(session.url, {
+      method: 'PUT',
+      headers: { 'Content-Type': 'application/octet-stream', 'Content-Range': `bytes ${session.received}-${end - 1}/${file.size}` },
+      body: file.slice(session.received, end),
+    }).then(data => {
+      session.received = data.received
+      return sendChunks(file, session, 0)
+    }, error => {
+      //a dropped connection or a chunk the server already has: ask where to resume and carry on
+      if(retries >= 5 || (error.status && error.status != 409)){
+        throw error
+      }
+      return new Promise(resolve => setTimeout(resolve, 1000 * (retries + 1)))
+        .then(() => call(session.url, { method: 'GET' }))
+        .then(data => {
+          session.received = data.received
+          return sendChunks(file, session, retries + 1)
+        })
+    })
+  }
+
+  function uploadFile(file){
+    let body = new FormData()
+    body.append('filename', file.name)
+    body.append('size', file.size)
+    return call(form.dataset.chunked, { method: 'POST', body: body }).then(session => sendChunks(file, session, 0))
+  }
+
+  form.addEventListener('submit', event => {
+    event.preventDefault()
+    let queue = Array.from(form.querySelector('input[type=file]').files)
+    let total = queue.length
+    let done = 0
+    button.disabled = true
+    status.textContent = `Uploading 0 of ${total}`
+
+    //three files in flight at a time, each one a chunk at a time
+    function next(){
+      let file = queue.shift()
+      if(!file){
+        return Promise.resolve()
+      }
+      return uploadFile(file).then(() => {
+        done += 1
+        status.textContent = `Uploading ${done} of ${total}`
+        return next()
+      })
+    }
+    let workers = []
+    for(let i = 0; i < Math.min(3, total); i++){
+      workers.push(next())
+    }
+    Promise.all(workers).then(() => {
+      window.location = form.dataset.done
+    }, error => {
+      status.textContent = `Upload failed (${error.message}), ${done} of ${total} files were saved`
+      button.disabled = false
+    })
+  })
+})
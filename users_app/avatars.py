@@ -0,0 +1,45 @@
+from library_app.renditions import decode, generate_renditions, renditions_for
+
+
+##the profile picture is resized once, when it is uploaded, into these renditions (twice the
+##css width of the navbar icon and of the picture on the profile page); jpeg is enough at this size
+AVATAR_SIZES = {
+    'avatar': (80, 80, False),
+    'avatar_large': (200, 200, False),
+}
+
+##{'nav': url, 'profile': url} kept on the session, so the navbar costs no query or storage call
+SESSION_KEY = 'avatar'
+
+
+def generate(field_file, upload=None):
+    ##pass the uploaded file to resize it from memory instead of reading it back from storage
+    img = None
+    if upload is not None:
+        upload.seek(0)
+        img = decode(upload)
+    return generate_renditions(field_file, AVATAR_SIZES, img=img, encodings=['jpeg'])
+
+
+def urls(profile):
+    ##pictures from before avatars were resized (and the default one) fall back to the original
+    found = renditions_for([profile.image.name]).get(profile.image.name, {})
+    return {
+        key: found[size].file.url if size in found else profile.image.url
+        for key, size in (('nav', 'avatar'), ('profile', 'avatar_large'))
+    }
+
+
+def remember(request, profile):
+    request.session[SESSION_KEY] = urls(profile)
+    return request.session[SESSION_KEY]
+
+
+def avatar(request):
+    ##context processor. the urls are looked up on the first page of a session and after the
+    ##picture changes (users_app.views.profile); other sessions of the user keep the old
+    ##picture until they sign in again, its files are not deleted
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'avatar': request.session.get(SESSION_KEY) or remember(request, user.profile)}
@@ -0,0 +1,26 @@
+from django.db import IntegrityError, models, transaction
+from django.db.models.fields.related_descriptors import ReverseOneToOneDescriptor
+
+
+class AutoReverseOneToOneDescriptor(ReverseOneToOneDescriptor):
+    ##user.profile creates the row the first time it is read and is missing, instead of a
+    ##post_save receiver creating one for every new user up front
+
+    def __get__(self, instance, cls=None):
+        try:
+            return super().__get__(instance, cls)
+        except self.RelatedObjectDoesNotExist:
+            model = self.related.related_model
+            lookup = {self.related.field.name: instance}
+            try:
+                with transaction.atomic():
+                    related = model._default_manager.create(**lookup)
+            except IntegrityError:
+                ##created by a parallel request since the read above
+                related = model._default_manager.get(**lookup)
+            self.related.set_cached_value(instance, related)
+            return related
+
+
+class AutoOneToOneField(models.OneToOneField):
+    related_accessor_class = AutoReverseOneToOneDescriptor
@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
+from . import avatars
 from .models import Profile
 
 ##this inherits from the form, to allow the email address to be added when registering a new user
@@ -22,4 +23,11 @@ class UserUpdateForm(forms.ModelForm):
 class ProfileUpdateForm(forms.ModelForm):
     class Meta:
         model = Profile
-        fields = ['image']
\ No newline at end of file
+        fields = ['image']
+
+    def save(self, commit=True):
+        profile = super().save(commit)
+        ##a new picture is resized for the navbar and the profile page once, here
+        if commit and 'image' in self.changed_data and self.cleaned_data.get('image'):
+            avatars.generate(profile.image, self.cleaned_data['image'])
+        return profile
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.3 on 2026-10-18 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users_app', '0003_auto_20200212_0456'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='bytes_used',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
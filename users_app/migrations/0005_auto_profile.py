@@ -0,0 +1,22 @@
+# Generated by Django 3.0.3 on 2026-10-18 03:15
+
+from django.conf import settings
+from django.db import migrations
+import django.db.models.deletion
+import users_app.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users_app', '0004_usage_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='user',
+            field=users_app.fields.AutoOneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.3 on 2026-10-18 03:32
+
+from django.db import migrations, models
+import library_app.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users_app', '0005_auto_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='fragment_version',
+            field=models.BigIntegerField(default=library_app.models.fragment_version),
+        ),
+    ]
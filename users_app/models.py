@@ -2,19 +2,67 @@ from django.db import models
 from django.contrib.auth.models import User
 from PIL import Image
 
+from django.db.models import Sum
+from library_app.models import Album, CounterFieldsMixin, fragment_version
 
-##the receiver automatically assigns a profile picture to new registered users. Post_save works with that
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from .fields import AutoOneToOneField
 
 
-class Profile(models.Model):
-    user = models.OneToOneField(User, on_delete = models.CASCADE)
+##new users get their profile (and the default picture) the first time user.profile is read,
+##see AutoOneToOneField. a save only writes the fields that changed since the profile was loaded
+class Profile(CounterFieldsMixin, models.Model):
+    user = AutoOneToOneField(User, on_delete = models.CASCADE)
     image = models.ImageField(default='default.jpg', upload_to='profile_pics')
+    ##pictures stored across all albums and their bytes, for quotas (library_app/usage.py)
+    image_count = models.PositiveIntegerField(default=0)
+    bytes_used = models.BigIntegerField(default=0)
+    ##bumped with every change to the user's albums, keys the cached album list (library_app/fragments.py)
+    fragment_version = models.BigIntegerField(default=fragment_version)
+
+    counter_fields = ('image_count', 'bytes_used', 'fragment_version')
 
     def __str__(self):
         return f'{self.user.username} Profile'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded = instance.field_values()
+        return instance
+
+    def field_values(self):
+        ##as written to the database, a picture is its name; deferred fields are left out
+        deferred = self.get_deferred_fields()
+        return {
+            field.attname: field.get_prep_value(getattr(self, field.attname))
+            for field in self._meta.concrete_fields if field.attname not in deferred
+        }
+
+    def changed_fields(self):
+        loaded = getattr(self, '_loaded', {})
+        current = self.field_values()
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.name not in self.counter_fields and field.attname in current
+            and (field.attname not in loaded or loaded[field.attname] != current[field.attname]
+                 or not getattr(getattr(self, field.attname), '_committed', True))
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.user_id and not self.image_count and not self.bytes_used:
+            ##a profile created after its user already uploaded starts from the album counters
+            totals = Album.objects.filter(user_id = self.user_id).aggregate(
+                image_count = Sum('image_count'), bytes_used = Sum('bytes_used'))
+            self.image_count = totals['image_count'] or 0
+            self.bytes_used = totals['bytes_used'] or 0
+        elif not self._state.adding and 'update_fields' not in kwargs and not kwargs.get('force_insert'):
+            changed = self.changed_fields()
+            if not changed:
+                return
+            kwargs['update_fields'] = changed
+        super().save(*args, **kwargs)
+        self._loaded = self.field_values()
+
     # def save(self, *args, **kwargs):
     #     super().save(*args, **kwargs)
     #     img = Image.open(self.image.path)
@@ -23,14 +71,3 @@ class Profile(models.Model):
     #         output_size = (400,400)
     #         rgb_im.thumbnail(output_size)
     #         rgb_im.save(self.image.path)
-
-
-##these functions are combined with the receiver 
-@receiver(post_save, sender=User)
-def create_profile(sender, instance, created, **kwargs):
-    if created:
-        Profile.objects.create(user=instance)
-
-@receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
-    instance.profile.save()
\ No newline at end of file
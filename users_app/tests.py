@@ -1,3 +1,118 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image as PILImage
+
+from library_app.models import Album, Rendition
+from . import avatars
+from .models import Profile
+
+
+class ProfileTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pass12345')
+
+    def test_login_leaves_the_profile_alone(self):
+        self.user.profile
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(reverse('login'), {'username': 'alice', 'password': 'pass12345'})
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+        self.assertFalse([query for query in captured if 'users_app_profile' in query['sql']])
+
+    def test_created_on_first_read(self):
+        self.assertFalse(Profile.objects.exists())
+        Album.objects.create(title='Trip', user=self.user, image_count=2, bytes_used=10)
+
+        user = User.objects.get(id=self.user.id)
+        profile = user.profile
+        self.assertEqual((profile.image_count, profile.bytes_used), (2, 10))
+        self.assertEqual(profile.image.name, 'default.jpg')
+        with self.assertNumQueries(0):
+            self.assertIs(user.profile, profile)
+        self.assertEqual(User.objects.get(id=self.user.id).profile, profile)
+        self.assertEqual(Profile.objects.count(), 1)
+
+    def test_save_writes_only_changed_fields(self):
+        self.user.profile
+        profile = Profile.objects.get(user=self.user)
+        with self.assertNumQueries(0):
+            profile.save()
+
+        profile.image = 'profile_pics/me.jpg'
+        with CaptureQueriesContext(connection) as captured:
+            profile.save()
+        self.assertEqual(len(captured), 1)
+        self.assertIn('"image"', captured[0]['sql'])
+        self.assertNotIn('image_count', captured[0]['sql'])
+        with self.assertNumQueries(0):
+            profile.save()
+        self.assertEqual(Profile.objects.get().image.name, 'profile_pics/me.jpg')
+
+
+class AvatarTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings = override_settings(
+            DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+            STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+            MEDIA_ROOT=media_root,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pass12345')
+        self.client.force_login(self.user)
+
+    def upload_picture(self):
+        buf = BytesIO()
+        PILImage.new('RGB', (1000, 800), 'navy').save(buf, 'JPEG')
+        return self.client.post(reverse('profile'), {
+            'username': 'alice',
+            'email': 'alice@example.com',
+            'image': SimpleUploadedFile('me.jpg', buf.getvalue(), content_type='image/jpeg'),
+        })
+
+    def test_default_picture_until_one_is_uploaded(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['avatar'], {'nav': '/media/default.jpg', 'profile': '/media/default.jpg'})
+
+    def test_upload_is_resized_once(self):
+        self.upload_picture()
+
+        profile = Profile.objects.get()
+        renditions = {r.size: r for r in Rendition.objects.filter(source=profile.image.name)}
+        self.assertEqual(set(renditions), set(avatars.AVATAR_SIZES))
+        self.assertEqual((renditions['avatar'].width, renditions['avatar'].height), (80, 64))
+        self.assertEqual({r.format for r in renditions.values()}, {'jpeg'})
+        self.assertEqual(self.client.session[avatars.SESSION_KEY], {
+            'nav': renditions['avatar'].file.url,
+            'profile': renditions['avatar_large'].file.url,
+        })
+
+        response = self.client.get(reverse('profile'))
+        self.assertContains(response, renditions['avatar'].file.url)
+        self.assertContains(response, renditions['avatar_large'].file.url)
+        self.assertNotContains(response, f'src="{profile.image.url}"')
+
+    def test_navbar_costs_nothing_after_the_first_page(self):
+        self.upload_picture()
+        self.client.get(reverse('dashboard'))
+
+        ##session and user only
+        with self.assertNumQueries(2), \
+                mock.patch('django.core.files.storage.FileSystemStorage.exists') as exists, \
+                mock.patch('django.core.files.storage.FileSystemStorage.open') as opened:
+            response = self.client.get(reverse('dashboard'))
+        self.assertFalse(exists.called or opened.called)
+        self.assertContains(response, self.client.session[avatars.SESSION_KEY]['nav'])
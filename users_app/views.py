@@ -2,6 +2,7 @@ from django.shortcuts import render, redirect
 from django.contrib import messages
 from .forms import UserRegisterForm, UserUpdateForm, ProfileUpdateForm
 from django.contrib.auth.decorators import login_required
+from . import avatars
 
 def register(request):
     if request.method == 'POST':
@@ -26,7 +27,7 @@ def profile(request):
 
         if u_form.is_valid() and p_form.is_valid():
             u_form.save()
-            p_form.save()
+            avatars.remember(request, p_form.save())
             messages.success(request, f'Your account has been updated')
             return redirect('profile')
     else: 